@@ -0,0 +1,97 @@
+from random import Random
+
+import pygame
+import pytest
+
+from rl.apps.car.common.constants import CANVAS_AREA
+from rl.apps.car.environment.car import Action
+from rl.apps.car.environment.environment import ObservationRenderer, reset_environment, step_environment, \
+    _to_observation, _to_done
+from rl.apps.car.environment.rl import _RESET_CAR_FACTORIES_SHORT
+from rl.apps.car.helpers.canvas import get_background, draw_car, render_background_array, Canvas, \
+    _get_shared_background, _load_background_cache
+
+_SCRIPTED_STEPS = 300
+_SCRIPTED_SEED = 7
+
+# Mostly accelerating and keeping straight, with occasional turns and braking
+_SCRIPTED_ACTIONS = [
+    Action.ACCELERATION, Action.NONE, Action.NONE, Action.LEFT, Action.NONE, Action.RIGHT,
+    Action.NONE, Action.NONE, Action.DECELERATION, Action.ACCELERATION,
+]
+
+
+def _get_scripted_actions():
+    random = Random(_SCRIPTED_SEED)
+    return [random.choice(_SCRIPTED_ACTIONS) for _ in range(_SCRIPTED_STEPS)]
+
+
+def _clear_background_caches():
+    _get_shared_background.cache_clear()
+    _load_background_cache.cache_clear()
+
+
+def bench_render_background(benchmark):
+    benchmark("render_background_array", render_background_array, rounds=3, warmup=0)
+
+
+def bench_get_background_cold(benchmark):
+    # In-process caches only, so this measures loading the on-disk cache
+    benchmark("get_background cold", get_background, rounds=3, warmup=0, setup=_clear_background_caches)
+
+
+def bench_get_background_warm(benchmark):
+    benchmark("get_background warm", get_background)
+
+
+@pytest.mark.parametrize("renderer", list(ObservationRenderer), ids=lambda renderer: renderer.name)
+def bench_step_environment(benchmark, renderer):
+    # Without the state view, as in rollout workers, so only what the renderer needs is drawn
+    state, _ = reset_environment(_RESET_CAR_FACTORIES_SHORT[0](), renderer, view=False)
+    benchmark(
+        f"step_environment {renderer.name}",
+        lambda: step_environment(state, Action.NONE, renderer, view=False),
+        rounds=50,
+    )
+
+
+def bench_step_environment_canvas(benchmark):
+    canvas = Canvas()
+    state, _ = reset_environment(_RESET_CAR_FACTORIES_SHORT[0](), canvas=canvas)
+    benchmark(
+        "step_environment canvas",
+        lambda: step_environment(state, Action.NONE, canvas=canvas),
+        rounds=50,
+    )
+
+
+@pytest.mark.parametrize("renderer", list(ObservationRenderer), ids=lambda renderer: renderer.name)
+def bench_to_observation(benchmark, renderer):
+    state, observation = reset_environment(_RESET_CAR_FACTORIES_SHORT[0](), renderer)
+    benchmark(f"_to_observation {renderer.name}", lambda: _to_observation(state, observation.car, renderer), rounds=50)
+
+
+def bench_to_done(benchmark):
+    state, _ = reset_environment(_RESET_CAR_FACTORIES_SHORT[0]())
+    benchmark("_to_done", lambda: _to_done(state, False), rounds=200)
+
+
+def bench_draw_car(benchmark):
+    surface = pygame.Surface(CANVAS_AREA)
+    car = _RESET_CAR_FACTORIES_SHORT[0]()
+    benchmark("draw_car", lambda: draw_car(surface, car), rounds=200)
+
+
+@pytest.mark.parametrize("renderer", list(ObservationRenderer), ids=lambda renderer: renderer.name)
+@pytest.mark.parametrize("factory", range(len(_RESET_CAR_FACTORIES_SHORT)))
+def bench_scripted_steps(benchmark, factory, renderer):
+    actions = _get_scripted_actions()
+
+    def run():
+        state, _ = reset_environment(_RESET_CAR_FACTORIES_SHORT[factory](), renderer, view=False)
+        for action in actions:
+            state, _, _, done = step_environment(state, action, renderer, view=False)
+            if done:
+                state, _ = reset_environment(_RESET_CAR_FACTORIES_SHORT[factory](), renderer, view=False)
+
+    benchmark(f"scripted steps factory {factory} {renderer.name}", run, rounds=3, items=len(actions))
@@ -0,0 +1,74 @@
+import pytest
+import torch
+
+from rl.apps.car.common.constants import OBSERVATION_INPUT_SIDE
+from rl.apps.car.environment.car import Action
+from rl.apps.car.environment.environment import reset_environment
+from rl.apps.car.environment.rl import _RESET_CAR_FACTORIES_SHORT
+from rl.apps.car.helpers.rollout import to_observation_tensors
+from rl.apps.car.model.buffer import RolloutBuffer
+from rl.apps.car.model.model import SelfDrivingCarModelParams, SelfDrivingCarModel, ScalarInputs, \
+    get_vision_input_channels, get_decision_input_scalars, stack_observations
+from rl.apps.car.model.rl import RlModel
+
+_VISION_HIDDENS = [8, 10, 12, 16, 32]  # Same as main.run_training_plan() defaults
+_DECISION_HIDDENS = [1024, 512, 256, 128]
+
+
+def _create_model(scalar_inputs: ScalarInputs) -> RlModel:
+    torch.manual_seed(0)
+    vision_dimensions = [get_vision_input_channels(scalar_inputs), *_VISION_HIDDENS]
+    side = OBSERVATION_INPUT_SIDE / (2 ** (len(vision_dimensions) - 2))
+    return RlModel(
+        module=SelfDrivingCarModel(SelfDrivingCarModelParams(
+            vision_dimensions=vision_dimensions,
+            vision_dropout=0.0,
+            decision_dimensions=[
+                int(vision_dimensions[-1] * side * side) + get_decision_input_scalars(scalar_inputs),
+                *_DECISION_HIDDENS,
+                len(Action),
+            ],
+            decision_residual=True,
+            decision_dropout=0.3,
+            scalar_inputs=scalar_inputs,
+        )),
+        dry_run=False,
+        learning_rate=1e-5,
+        weight_decay=1e-5,
+    )
+
+
+def _get_observation():
+    _, observation = reset_environment(_RESET_CAR_FACTORIES_SHORT[0]())
+    return observation
+
+
+def bench_to_observation_tensors(benchmark):
+    observation = _get_observation()
+    benchmark("to_observation_tensors", lambda: to_observation_tensors(observation), rounds=200)
+
+
+@pytest.mark.parametrize("scalar_inputs", list(ScalarInputs), ids=lambda scalar_inputs: scalar_inputs.name)
+def bench_act(benchmark, scalar_inputs):
+    model = _create_model(scalar_inputs)
+    observation = to_observation_tensors(_get_observation())
+    benchmark(f"RlModel.act {scalar_inputs.name}", lambda: model.act(observation), rounds=50)
+
+
+@pytest.mark.parametrize("batch_size", [16, 64])
+def bench_act_batch(benchmark, batch_size):
+    model = _create_model(ScalarInputs.DECISION)
+    observations = stack_observations([to_observation_tensors(_get_observation())] * batch_size)
+    benchmark(f"RlModel.act_batch {batch_size}", lambda: model.act_batch(observations), rounds=10, items=batch_size)
+
+
+@pytest.mark.parametrize("batch_size", [16, 64, 256])
+def bench_backprop(benchmark, batch_size):
+    model = _create_model(ScalarInputs.DECISION)
+    observation = to_observation_tensors(_get_observation())
+    rollouts = RolloutBuffer()
+    rollouts.start_batch()
+    for index in range(batch_size):
+        rollouts.append(observation, index % len(Action), 1.)
+    rollouts.weights[:batch_size] = 1.
+    benchmark(f"RlModel.backprop {batch_size}", lambda: model.backprop(rollouts), rounds=3, items=batch_size)
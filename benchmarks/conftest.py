@@ -0,0 +1,114 @@
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from typing import Callable, Dict, Optional
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")  # Headless
+
+_RESULTS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+_REGRESSION_RATIO = 1.2  # Median slower than baseline by more than this is reported as a regression
+
+_results: Dict[str, Dict[str, float]] = {}
+
+
+class Benchmark:
+    def __call__(
+            self,
+            name: str,
+            func: Callable[[], None],
+            rounds: int = 20,
+            warmup: int = 1,
+            setup: Optional[Callable[[], None]] = None,
+            items: int = 1,
+    ) -> float:
+        for _ in range(warmup):
+            if setup:
+                setup()
+            func()
+        times = []
+        for _ in range(rounds):
+            if setup:
+                setup()
+            start = time.perf_counter()
+            func()
+            times.append(time.perf_counter() - start)
+
+        median = statistics.median(times)
+        _results[name] = {
+            "median": median,
+            "min": min(times),
+            "rounds": rounds,
+            "items_per_second": items / median,
+        }
+        return median
+
+
+@pytest.fixture(scope="session", autouse=True)
+def pygame_session():
+    import pygame
+    pygame.init()
+    yield
+    pygame.quit()
+
+
+@pytest.fixture
+def benchmark() -> Benchmark:
+    return Benchmark()
+
+
+def pytest_addoption(parser):
+    parser.addoption("--save-baseline", action="store_true", help="Store the results as the new baseline")
+    parser.addoption("--baseline", default=os.path.join(_RESULTS_PATH, "baseline.json"), help="Baseline to compare to")
+
+
+def pytest_sessionfinish(session):
+    if not _results:
+        return
+    os.makedirs(_RESULTS_PATH, exist_ok=True)
+    output = {
+        "timestamp": time.strftime("%Y-%m-%dT%H-%M-%S"),
+        "machine": {"platform": platform.platform(), "python": platform.python_version(), "cpus": os.cpu_count()},
+        "results": _results,
+    }
+    with open(os.path.join(_RESULTS_PATH, "latest.json"), "w") as file:
+        json.dump(output, file, indent=2)
+
+    if session.config.getoption("--save-baseline"):  # Updates only the benchmarks that ran
+        baseline_path = session.config.getoption("--baseline")
+        if os.path.exists(baseline_path):
+            with open(baseline_path) as file:
+                output["results"] = {**json.load(file)["results"], **_results}
+        with open(baseline_path, "w") as file:
+            json.dump(output, file, indent=2)
+
+
+def pytest_terminal_summary(terminalreporter, config):
+    if not _results:
+        return
+    baseline_path = config.getoption("--baseline")
+    baseline = {}
+    if os.path.exists(baseline_path) and not config.getoption("--save-baseline"):
+        with open(baseline_path) as file:
+            baseline = json.load(file)["results"]
+
+    terminalreporter.section("benchmarks")
+    terminalreporter.write_line(f"{'name':60} {'median':>12} {'items/s':>12} {'baseline':>12} {'ratio':>7}")
+    regressions = 0
+    for name, result in sorted(_results.items()):
+        line = f"{name:60} {result['median'] * 1000:10.3f}ms {result['items_per_second']:12.1f}"
+        if name in baseline:
+            ratio = result["median"] / baseline[name]["median"]
+            regressed = ratio > _REGRESSION_RATIO
+            regressions += regressed
+            line += f" {baseline[name]['median'] * 1000:10.3f}ms {ratio:6.2f}x"
+            terminalreporter.write_line(line + (" REGRESSION" if regressed else ""), red=regressed)
+        else:
+            terminalreporter.write_line(line)
+    if baseline:
+        terminalreporter.write_line(f"{regressions} regression(s) against {baseline_path}")
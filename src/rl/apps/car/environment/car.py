@@ -1,7 +1,9 @@
-import copy
-from dataclasses import dataclass, field
+from dataclasses import dataclass
 from enum import Enum
-from typing import Optional, Tuple
+from functools import cache
+from typing import Optional, Tuple, NamedTuple
+
+import numpy as np
 
 from rl.apps.car.common.constants import CAR_MAX_TURN, CAR_MIN_TURN, CAR_MAX_SPEED, CAR_MIN_SPEED, \
     CAR_TURN_DEGREES_PER_FRAME, CAR_SPEED_PIXELS_PER_FRAME, MARGIN, ACTION_AREA, SIDE, ROAD_MAP
@@ -13,6 +15,7 @@ from rl.apps.car.utils.shapes import constraint_position, rectangle_contains
 from rl.apps.car.utils.vectors import left, right
 
 _STALE_COUNTER = 100
+_CURVED_OR_STRAIGHT_SHAPES = "─│┌┐└┘"  # The only shapes road_next_tile() resolves
 
 
 class Action(Enum):
@@ -29,7 +32,7 @@ class Blink(Enum):
     RIGHT = 2
 
 
-@dataclass
+@dataclass(frozen=True)
 class CrossroadEvent:
     blink: Blink
     blink_area: Rectangle
@@ -42,13 +45,12 @@ class CrossroadEvent:
     out_direction: Vector
 
 
-@dataclass
+@dataclass(frozen=True)
 class Events:
     crossroad: Optional[CrossroadEvent] = None
 
 
-@dataclass
-class CarState:
+class CarState(NamedTuple):  # Immutable and slotted, unchanged events and driver are shared between steps
     position: Vector
     angle: AngleDegrees  # °, counterclockwise
 
@@ -57,8 +59,8 @@ class CarState:
 
     decelerating: bool = False
     steps_stopped: int = 0
-    events: Events = field(default_factory=Events)
-    driver: DriverState = field(default_factory=DriverState)
+    events: Events = Events()
+    driver: DriverState = DriverState()
 
 
 @dataclass
@@ -82,37 +84,41 @@ def step_car(previous: CarState, action: Action) -> Tuple[CarState, CarObservati
 
 
 def _to_state(state: CarState, action: Optional[Action] = None) -> CarState:
-    result: CarState = copy.deepcopy(state)
+    position, angle, turn, speed = state.position, state.angle, state.turn, state.speed
+    decelerating, steps_stopped = state.decelerating, state.steps_stopped
 
     if action is not None:
         # Action
         if action == Action.LEFT:
-            result.turn = min(CAR_MAX_TURN, result.turn + 1)
+            turn = min(CAR_MAX_TURN, turn + 1)
         elif action == Action.RIGHT:
-            result.turn = max(CAR_MIN_TURN, result.turn - 1)
+            turn = max(CAR_MIN_TURN, turn - 1)
         elif action == Action.ACCELERATION:
-            result.speed = min(CAR_MAX_SPEED, result.speed + 1)
+            speed = min(CAR_MAX_SPEED, speed + 1)
         elif action == Action.DECELERATION:
-            result.speed = max(CAR_MIN_SPEED, result.speed - 1)
+            speed = max(CAR_MIN_SPEED, speed - 1)
 
         # Experience
-        if result.speed:
-            result.angle = (result.angle + result.turn * CAR_TURN_DEGREES_PER_FRAME) % 360
-            result.position = advance(result.position, result.angle, result.speed * CAR_SPEED_PIXELS_PER_FRAME)
-            result.position = constraint_position(result.position, (MARGIN, MARGIN, ACTION_AREA[0], ACTION_AREA[1]))
+        if speed:
+            angle = (angle + turn * CAR_TURN_DEGREES_PER_FRAME) % 360
+            position = advance(position, angle, speed * CAR_SPEED_PIXELS_PER_FRAME)
+            position = constraint_position(position, (MARGIN, MARGIN, ACTION_AREA[0], ACTION_AREA[1]))
 
-        if result.position != state.position:
-            result.steps_stopped = 0
+        if position != state.position:
+            steps_stopped = 0
         else:
-            result.steps_stopped += 1
+            steps_stopped += 1
 
-        result.decelerating = result.speed < state.speed
+        decelerating = speed < state.speed
 
     # Events
-    if not result.events.crossroad or not rectangle_contains(result.events.crossroad.blink_area, result.position):
-        result.events.crossroad = _check_crossroad_event(state.driver, result.position)
+    events = state.events
+    if not events.crossroad or not rectangle_contains(events.crossroad.blink_area, position):
+        crossroad = _check_crossroad_event(state.driver, position)
+        if crossroad is not events.crossroad:
+            events = Events(crossroad)
 
-    return result
+    return CarState(position, angle, turn, speed, decelerating, steps_stopped, events, state.driver)
 
 
 def _to_observation(state: CarState) -> CarObservation:
@@ -130,6 +136,11 @@ def _to_done(state: CarState) -> bool:
 def _check_crossroad_event(driver: DriverState, position: Vector) -> Optional[CrossroadEvent]:
     result = None
     tile_col, tile_row = get_tile(position)
+    candidate_tiles = _get_crossroad_candidate_tiles()
+    if 0 <= tile_col < candidate_tiles.shape[0] and 0 <= tile_row < candidate_tiles.shape[1]:
+        if not candidate_tiles[tile_col, tile_row]:
+            return result
+
     if next_tile := road_next_tile(position, ROAD_MAP[tile_row][tile_col]):
         current_tile_col, current_tile_row = get_tile(position)
         next_tile_col, next_tile_row = next_tile
@@ -175,3 +186,28 @@ def _check_crossroad_event(driver: DriverState, position: Vector) -> Optional[Cr
                     out_direction=next_tile_option_direction,
                 )
     return result
+
+
+@cache
+def _get_crossroad_candidate_tiles() -> np.ndarray:
+    # (cols, rows), tiles where _check_crossroad_event() may produce an event, all others are known to produce none
+    cols, rows = ACTION_AREA[0] // SIDE + 1, ACTION_AREA[1] // SIDE + 1
+    result = np.zeros((cols, rows), dtype=bool)
+    for tile_col in range(cols):
+        for tile_row in range(rows):
+            result[tile_col, tile_row] = _is_crossroad_candidate_tile((tile_col, tile_row))
+    return result
+
+
+def _is_crossroad_candidate_tile(tile: Vector) -> bool:
+    tile_col, tile_row = tile
+    try:
+        if ROAD_MAP[tile_row][tile_col] not in _CURVED_OR_STRAIGHT_SHAPES:
+            return False
+        for next_tile in [(tile_col - 1, tile_row), (tile_col + 1, tile_row),
+                          (tile_col, tile_row - 1), (tile_col, tile_row + 1)]:
+            if len([option for option in get_adjacent_tiles(next_tile) if option != tile]) > 1:
+                return True
+    except IndexError:
+        return True  # Off the map, left to the full check
+    return False
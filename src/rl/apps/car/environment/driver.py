@@ -1,14 +1,17 @@
-from dataclasses import dataclass, field
+from dataclasses import dataclass
 from random import Random
-from typing import TypeVar, Sequence
+from typing import TypeVar, Sequence, Tuple
 
 T = TypeVar("T")
 _SEED = 11
+_RANDOM = Random()  # Scratch generator, drivers only hold its immutable state
 
 
-@dataclass
+@dataclass(frozen=True)
 class DriverState:
-    random: Random = field(default_factory=lambda: Random(_SEED))
+    random_state: Tuple = Random(_SEED).getstate()
 
     def choose(self, options: Sequence[T]) -> T:
-        return self.random.choice(options)
+        # Does not advance the driver, same choices as always choosing from the initial generator state
+        _RANDOM.setstate(self.random_state)
+        return _RANDOM.choice(options)
@@ -1,62 +1,130 @@
+import os
 from dataclasses import dataclass
-from typing import Tuple, Optional
+from enum import Enum
+from typing import Tuple, Optional, Union
 
+import numpy as np
 import pygame
 from pygame import Surface
 
 from rl.apps.car.common.constants import CANVAS_AREA, OBSERVATION_INPUT_AREA, OBSERVATION_DOWNSCALE_RATIO, \
-    OBSERVATION_OUTPUT_AREA, CAR_LENGTH, CAR_WIDTH, DARK_GRAY, CENTERLINE
+    OBSERVATION_OUTPUT_AREA, CAR_LENGTH, CAR_WIDTH
 from rl.apps.car.environment.car import CarState, CarObservation, reset_car, Action, step_car
-from rl.apps.car.helpers.canvas import draw_state, get_background
-from rl.apps.car.utils.map import road_next_tile, get_tile
+from rl.apps.car.helpers.camera import render_observation
+from rl.apps.car.helpers.canvas import draw_state, get_obstacle_mask, Canvas
+from rl.apps.car.utils.map import road_next_tiles, get_tiles
 from rl.apps.car.utils.shapes import rectangle_to_polygon, rotate_polygon, extend_rectangle, bound_rectangle, \
-    iterate_polygon_perimeter
+    polygon_perimeter
+from rl.apps.car.utils.timers import timer
+
+
+class ObservationRenderer(Enum):
+    PYGAME = 1
+    NUMPY = 2
+
+
+def get_observation_renderer() -> ObservationRenderer:
+    return ObservationRenderer[os.environ.get("OBSERVATION_RENDERER", ObservationRenderer.PYGAME.name).upper()]
 
 
 @dataclass
 class State:
     car: CarState
-    view: Surface
-    background: Surface
+    # None when not rendered, or not drawn as only the observation was needed. When drawn on a Canvas,
+    # valid until its next draw
+    view: Optional[Surface]
 
 
 @dataclass
 class Observation:
     car: CarObservation
-    view: Surface
+    # Surface, or (W, H, 3) pixels when rendered by ObservationRenderer.NUMPY, None when not rendered
+    view: Optional[Union[Surface, np.ndarray]]
 
 
-def reset_environment(seed: CarState) -> Tuple[State, Observation]:
+def reset_environment(
+        seed: CarState,
+        renderer: ObservationRenderer = ObservationRenderer.PYGAME,
+        render: bool = True,
+        canvas: Optional[Canvas] = None,
+        view: bool = True,
+) -> Tuple[State, Observation]:
     # Dependencies
-    car_state, car_observation = reset_car(seed)
+    with timer("car"):
+        car_state, car_observation = reset_car(seed)
 
     # Reconcile
-    state = _to_state(car_state)
-    observation = _to_observation(state, car_observation)
-    return state, observation
-
-
-def step_environment(previous: State, action: Action) -> Tuple[State, Observation, float, float]:
+    if not render:
+        return State(car_state, None), Observation(car_observation, None)
+    return render_environment(car_state, car_observation, renderer, canvas=canvas, view=view)
+
+
+def step_environment(
+        previous: State,
+        action: Action,
+        renderer: ObservationRenderer = ObservationRenderer.PYGAME,
+        render: bool = True,
+        canvas: Optional[Canvas] = None,
+        view: bool = True,
+) -> Tuple[State, Observation, float, float]:
     # Dependencies
-    car_state, car_observation, car_reward, car_done = step_car(previous.car, action)
+    with timer("car"):
+        car_state, car_observation, car_reward, car_done = step_car(previous.car, action)
 
     # Reconcile
-    state = _to_state(car_state, previous.car)
-    observation = _to_observation(state, car_observation)
+    if render:
+        state, observation = render_environment(car_state, car_observation, renderer, previous.car, canvas, view)
+    else:
+        state, observation = State(car_state, None), Observation(car_observation, None)
     reward = _to_reward(state, car_reward)
-    done = _to_done(state, car_done)
+    with timer("collision"):
+        done = _to_done(state, car_done)
     return state, observation, reward, done
 
 
-def _to_state(car_state: CarState, previous_car: Optional[CarState] = None) -> State:
+def render_environment(
+        car_state: CarState,
+        car_observation: CarObservation,
+        renderer: ObservationRenderer = ObservationRenderer.PYGAME,
+        previous_car: Optional[CarState] = None,
+        canvas: Optional[Canvas] = None,
+        view: bool = True,
+) -> Tuple[State, Observation]:
+    # When not view, the state is drawn only if the renderer needs it
+    with timer("canvas"):
+        if view or renderer == ObservationRenderer.PYGAME:  # Cut from the state view
+            state = _to_state(car_state, previous_car, canvas)
+        else:
+            state = State(car_state, None)
+    with timer("observation"):
+        observation = _to_observation(state, car_observation, renderer)
+    return state, observation
+
+
+def _to_state(
+        car_state: CarState,
+        previous_car: Optional[CarState] = None,
+        canvas: Optional[Canvas] = None,
+) -> State:
+    if canvas is not None:
+        return State(car=car_state, view=canvas.draw_state(car_state, previous_car))
     return State(
         car=car_state,
         view=draw_state(pygame.Surface(CANVAS_AREA), car_state, previous_car),
-        background=get_background(),
     )
 
 
-def _to_observation(state: State, car_observation: CarObservation) -> Observation:
+def _to_observation(
+        state: State,
+        car_observation: CarObservation,
+        renderer: ObservationRenderer = ObservationRenderer.PYGAME,
+) -> Observation:
+    if renderer == ObservationRenderer.NUMPY:
+        return Observation(
+            car=car_observation,
+            view=render_observation(state.car),
+        )
+
     # Select bounded car view
     car_x, car_y = state.car.position
     observation_input_width, observation_input_height = OBSERVATION_INPUT_AREA
@@ -99,17 +167,18 @@ def _to_done(state: State, car_done: bool) -> bool:
     car_x, car_y = state.car.position
     corners = rectangle_to_polygon((car_x - CAR_LENGTH / 2, car_y - CAR_WIDTH / 2, CAR_LENGTH, CAR_WIDTH))
     rotated_corners = rotate_polygon(corners, state.car.angle, state.car.position)
+    perimeter = polygon_perimeter(rotated_corners)
 
-    for corner in iterate_polygon_perimeter(rotated_corners):
-        color = state.background.get_at(corner)
-        if color in [DARK_GRAY, CENTERLINE]:
-            return True
+    perimeter_x, perimeter_y = perimeter.T
+    if get_obstacle_mask()[perimeter_x, perimeter_y].any():
+        return True
 
-        corner_tile = get_tile(corner)
-        if state.car.events.crossroad and corner_tile == state.car.events.crossroad.tile:
-            # When on crossroad, must drive by the trajectory
-            if road_next_tile(corner, state.car.events.crossroad.trajectory) != state.car.events.crossroad.next_tile:
-                return True
+    if crossroad := state.car.events.crossroad:
+        # When on crossroad, must drive by the trajectory
+        on_crossroad = perimeter[np.all(get_tiles(perimeter) == crossroad.tile, axis=1)]
+        next_tiles, found = road_next_tiles(on_crossroad, crossroad.trajectory)
+        if not np.all(found & np.all(next_tiles == crossroad.next_tile, axis=1)):
+            return True
     return False
 
 
@@ -125,6 +194,5 @@ def _verify_always_fails(car: CarState) -> bool:
         would_fail(Action.ACCELERATION),
         would_fail(Action.DECELERATION),
     ]):
-        print()
         return True
     return False
@@ -1,14 +1,18 @@
-import copy
 from dataclasses import dataclass
 from enum import Enum
 from typing import Tuple, Optional, List
 
 from rl.apps.car.common.constants import SIDE, MARGIN
+from rl.apps.car.common.types import Vector
 from rl.apps.car.environment.car import Action, CarState
-from rl.apps.car.environment.environment import State, Observation, reset_environment, step_environment
-from rl.apps.car.helpers.canvas import draw_car
+from rl.apps.car.environment.environment import State, Observation, reset_environment, step_environment, \
+    ObservationRenderer, get_observation_renderer, render_environment
+from rl.apps.car.helpers.canvas import Canvas
+from rl.apps.car.utils.collections import RingBuffer, LastDistinct
 
 _DRAW_RESET_CARS = True
+_HISTORY_CAPACITY = 100
+_CRASH_REPLAY_STEPS_INTO_PAST = 10
 
 _RESET_CAR_FACTORIES_LONG = [  # Clockwise
     lambda: CarState(position=(MARGIN + 2.7 * SIDE, MARGIN + 2 * SIDE), angle=90, speed=1, turn=0),
@@ -63,8 +67,7 @@ class RlEnvironmentMode(Enum):
 @dataclass
 class RlEnvironmentHistoryItem:
     action: Optional[Action]
-    state: State
-    observation: Observation
+    car: CarState
     reward: Optional[float]
 
 
@@ -73,39 +76,78 @@ class RlEnvironment:
             self,
             mode: RlEnvironmentMode,
             total_resets: int,
+            renderer: Optional[ObservationRenderer] = None,
+            reset_index: int = 0,
+            render: bool = True,
+            view: bool = True,
     ):
         self.mode = mode
         self.total_resets = total_resets
+        self.renderer = renderer or get_observation_renderer()
 
-        self.reset_index = 0
-        self.history: List[RlEnvironmentHistoryItem] = []
+        self.reset_index = reset_index
+        self.render_steps = render  # When False, reset() and step() leave rendering to render()
+        self.view = view  # When False, states are drawn only if the renderer needs them for observations
+        self.canvas = Canvas()  # Drawn on incrementally, so state views are valid until the next render
+        self.state: Optional[State] = None
+        self.observation: Optional[Observation] = None
+        self.history: RingBuffer[RlEnvironmentHistoryItem] = RingBuffer(_HISTORY_CAPACITY)
+        self.distinct_cars: LastDistinct[Vector, CarState] = LastDistinct(_CRASH_REPLAY_STEPS_INTO_PAST + 1)
 
     def reset(self) -> Tuple[State, Observation]:
-        state, observation = reset_environment(self._pick_reset_car())
-
+        state, observation = reset_environment(
+            self._pick_reset_car(),
+            self.renderer,
+            self.render_steps,
+            self.canvas,
+            self.view,
+        )
+
+        self.state = state
+        self.observation = observation
         self.history.clear()
-        self.history.append(RlEnvironmentHistoryItem(None, state, observation, None))
+        self.distinct_cars.clear()
+        self._append_history(None, state.car, None)
         self.reset_index += 1
         return state, observation
 
     def step(self, action: Action) -> Tuple[State, Observation, float, float]:
-        state, observation, reward, done = step_environment(self.history[-1].state, action)
+        state, observation, reward, done = step_environment(
+            self.state,
+            action,
+            self.renderer,
+            self.render_steps,
+            self.canvas,
+            self.view,
+        )
+
+        self.state = state
+        self.observation = observation
+        self._append_history(action, state.car, reward)
+        self._draw_reset_cars()
+        return state, observation, reward, done
 
-        self.history.append(RlEnvironmentHistoryItem(action, state, observation, reward))
-        if _DRAW_RESET_CARS:
+    def render(self) -> Observation:
+        # Of the current state, the same as reset() or step() would have rendered
+        self.state, self.observation = render_environment(
+            self.state.car,
+            self.observation.car,
+            self.renderer,
+            canvas=self.canvas,
+            view=self.view,
+        )
+        if len(self.history) > 1:  # Stepped, as reset() does not draw them
+            self._draw_reset_cars()
+        return self.observation
+
+    def _draw_reset_cars(self):
+        if _DRAW_RESET_CARS and self.state.view is not None:
             for reset_car_factory in _RESET_CAR_FACTORIES:
-                draw_car(state.view, reset_car_factory())
-        return state, observation, reward, done
+                self.canvas.draw_car(reset_car_factory())
 
     def _pick_reset_car(self) -> CarState:
         if self.mode == RlEnvironmentMode.ORDERED_WITH_CRASH_REPLAY:
-            if self.total_resets % len(_RESET_CAR_FACTORIES) != 0:
-                raise ValueError(
-                    f"When using {self.mode.name}, total resets (currently {self.total_resets})"
-                    f"must be divisible by reset car factories (currently {len(_RESET_CAR_FACTORIES)})"
-                )
-
-            resets_per_car_state = self.total_resets // len(_RESET_CAR_FACTORIES)
+            resets_per_car_state = _get_resets_per_car_state(self.mode, self.total_resets)
             car_state_index: int = self.reset_index // resets_per_car_state
             previous_car_state_index = (self.reset_index - 1) // resets_per_car_state
             if car_state_index == previous_car_state_index:
@@ -117,15 +159,28 @@ class RlEnvironment:
 
         return result
 
-    def _get_car_before_crash(self, steps_into_past: int = 10) -> CarState:
-        result = copy.deepcopy(self.history[0].state.car)
-        skipped = set()
-        for item in reversed(self.history):
-            if item.state.car.position not in skipped:
-                result = copy.deepcopy(item.state.car)
-                if steps_into_past == 0:
-                    break
-                else:
-                    skipped.add(item.state.car.position)
-                    steps_into_past -= 1
-        return result
+    def _append_history(self, action: Optional[Action], car: CarState, reward: Optional[float]):
+        self.history.append(RlEnvironmentHistoryItem(action, car, reward))
+        self.distinct_cars.add(car.position, car)
+
+    def _get_car_before_crash(self) -> CarState:
+        # Latest car at the last but _CRASH_REPLAY_STEPS_INTO_PAST distinct position, or at the oldest one if fewer
+        return self.distinct_cars.oldest()
+
+
+def get_reset_chains(mode: RlEnvironmentMode, total_resets: int) -> List[Tuple[int, int]]:
+    # (first reset index, resets) of reset sequences independent of each other, each has to run in order
+    if mode == RlEnvironmentMode.ORDERED_WITH_CRASH_REPLAY:
+        resets_per_car_state = _get_resets_per_car_state(mode, total_resets)
+        return [(index, resets_per_car_state) for index in range(0, total_resets, resets_per_car_state)]
+    else:
+        raise NotImplementedError
+
+
+def _get_resets_per_car_state(mode: RlEnvironmentMode, total_resets: int) -> int:
+    if total_resets % len(_RESET_CAR_FACTORIES) != 0:
+        raise ValueError(
+            f"When using {mode.name}, total resets (currently {total_resets})"
+            f"must be divisible by reset car factories (currently {len(_RESET_CAR_FACTORIES)})"
+        )
+    return total_resets // len(_RESET_CAR_FACTORIES)
@@ -0,0 +1,100 @@
+import math
+from functools import lru_cache
+from typing import Tuple
+
+import numpy as np
+
+from rl.apps.car.common.constants import OBSERVATION_INPUT_AREA, OBSERVATION_DOWNSCALE_RATIO, \
+    OBSERVATION_OUTPUT_AREA
+from rl.apps.car.environment.car import CarState
+from rl.apps.car.helpers.canvas import get_background_array, get_car_sprite
+from rl.apps.car.utils.shapes import rectangle_to_polygon, rotate_polygon, extend_rectangle, bound_rectangle
+
+_ROTATE_CROP_INDICES = 1024  # Per view size and angle, angles being multiples of the turn rate plus the reset ones
+
+
+def render_observation(car: CarState) -> np.ndarray:
+    # Mirrors environment._to_observation() on the background pixels around the car only, as (W, H, 3)
+    # Select bounded car view
+    car_x, car_y = car.position
+    observation_input_width, observation_input_height = OBSERVATION_INPUT_AREA
+    camera_x, camera_y = car_x - observation_input_width / 8 * 1, car_y - observation_input_height / 2
+    corners = rectangle_to_polygon((camera_x, camera_y, observation_input_width, observation_input_height))
+    rotated_corners = rotate_polygon(corners, car.angle, (car_x, car_y))
+    view_x, view_y, view_width, view_height = (
+        int(value) for value in extend_rectangle(bound_rectangle(rotated_corners), 1)
+    )
+    view = get_background_array()[view_x:view_x + view_width, view_y:view_y + view_height].copy()
+
+    # Car
+    _paste_car(view, car, (view_x, view_y))
+
+    # Downscale
+    if OBSERVATION_DOWNSCALE_RATIO != 1:  # Nearest neighbour, close to but not exactly pygame.transform.scale()
+        view = view[
+            (np.arange(int(view_width * OBSERVATION_DOWNSCALE_RATIO)) / OBSERVATION_DOWNSCALE_RATIO).astype(int)
+        ][
+            :, (np.arange(int(view_height * OBSERVATION_DOWNSCALE_RATIO)) / OBSERVATION_DOWNSCALE_RATIO).astype(int)
+        ]
+
+    # Rotate car position and unbound
+    return _rotate_crop(view, 90 - car.angle, OBSERVATION_OUTPUT_AREA)
+
+
+def _paste_car(pixels: np.ndarray, car: CarState, offset: Tuple[int, int]):
+    # As draw_car() blits the sprite, clipped to the pixels
+    sprite, (sprite_x, sprite_y) = get_car_sprite(car)
+    x, y = sprite_x - offset[0], sprite_y - offset[1]
+    sprite_width, sprite_height = sprite.mask.shape
+    left, top = max(0, -x), max(0, -y)
+    right, bottom = min(sprite_width, pixels.shape[0] - x), min(sprite_height, pixels.shape[1] - y)
+    if left >= right or top >= bottom:
+        return
+
+    target = pixels[x + left:x + right, y + top:y + bottom]
+    mask = sprite.mask[left:right, top:bottom]
+    target[mask] = sprite.pixels[left:right, top:bottom][mask]
+
+
+def _rotate_crop(pixels: np.ndarray, angle: float, area: Tuple[int, int]) -> np.ndarray:
+    # Port of pygame.transform.rotate() (rotate() in transform.c), followed by a centered crop of the area
+    width, height = pixels.shape[:2]
+    indices = _get_rotate_crop_indices(width, height, float(np.float32(angle)), area)  # pygame parses a C float
+    return np.take(np.ascontiguousarray(pixels).reshape(width * height, -1), indices, axis=0)  # Faster than []
+
+
+@lru_cache(maxsize=_ROTATE_CROP_INDICES)
+def _get_rotate_crop_indices(width: int, height: int, angle: float, area: Tuple[int, int]) -> np.ndarray:
+    # (W, H) flat source pixel of every destination pixel, the top left one outside the source as pygame fills
+    # surfaces without colorkey with it
+    crop_width, crop_height = area
+    source = np.arange(width * height, dtype=np.int32).reshape(width, height)
+
+    if not math.fmod(angle, 90):
+        rotated = np.rot90(source, int(angle / 90) % 4, axes=(1, 0))
+        margin_x = int((rotated.shape[0] - crop_width) / 2)
+        margin_y = int((rotated.shape[1] - crop_height) / 2)
+        return rotated[margin_x:margin_x + crop_width, margin_y:margin_y + crop_height].copy()
+
+    radians = angle * .01745329251994329
+    sin, cos = math.sin(radians), math.cos(radians)
+    rotated_width = int(max(abs(cos * width + sin * height), abs(cos * width - sin * height),
+                            abs(-cos * width + sin * height), abs(-cos * width - sin * height)))
+    rotated_height = int(max(abs(sin * width + cos * height), abs(sin * width - cos * height),
+                             abs(-sin * width + cos * height), abs(-sin * width - cos * height)))
+    margin_x = int((rotated_width - crop_width) / 2)
+    margin_y = int((rotated_height - crop_height) / 2)
+
+    # 16.16 fixed point source coordinates of every destination pixel
+    i_sin, i_cos = int(sin * 65536), int(cos * 65536)
+    start_x = (rotated_width << 15) - int(cos * ((rotated_width - 1) << 15)) + ((width - rotated_width) << 15)
+    start_y = (rotated_height << 15) - int(sin * ((rotated_width - 1) << 15)) + ((height - rotated_height) << 15)
+    x = np.arange(margin_x, margin_x + crop_width, dtype=np.int64)[:, None]
+    y = np.arange(margin_y, margin_y + crop_height, dtype=np.int64)[None, :]
+    source_x = start_x + i_sin * (rotated_height // 2 - y) + i_cos * x
+    source_y = start_y - i_cos * (rotated_height // 2 - y) + i_sin * x
+
+    outside = (source_x < 0) | (source_y < 0) | (source_x > (width << 16) - 1) | (source_y > (height << 16) - 1)
+    result = source[np.clip(source_x >> 16, 0, width - 1), np.clip(source_y >> 16, 0, height - 1)]
+    result[outside] = 0
+    return result
@@ -1,13 +1,16 @@
+import hashlib
 import math
 import os
-import random
-from functools import cache
-from typing import Tuple, List
+import tempfile
+from functools import cache, lru_cache
+from typing import Tuple, List, Sequence, NamedTuple
 
+import numpy as np
 import pygame
 import pygame.gfxdraw
-from pygame import Surface, Color
+from pygame import Surface, Color, Rect
 
+from rl.apps.car.common import constants
 from rl.apps.car.common.constants import GREEN, DARK_GREEN, SIDE, HALF, GRAY, LIGHT_GRAY, CENTERLINE, \
     DARK_GRAY, PAD, ROAD_MAP, LIGHTEST_GRAY, MARGIN, WHITE, \
     LIGHT_BLACK, FONT_SIZE, CANVAS_AREA, CAR_LENGTH, CAR_WIDTH, COLOR_KEY, CAR_TURN_DEGREES_PER_FRAME, \
@@ -16,9 +19,23 @@ from rl.apps.car.common.types import Shape, AngleDegrees, Rectangle, Vector
 from rl.apps.car.environment.car import CarState, Blink
 from rl.apps.car.utils.map import get_tile_position, road_next_tile, get_tile, is_right, is_left, is_up, is_down
 from rl.apps.car.utils.shapes import rotate_polygon, rotate
+from rl.apps.car.utils import map as map_util, shapes, math_util
 from rl.apps.car.utils.then import then
 
 
+_BACKGROUND_SEED = 11
+_GRASS_LENGTH = 5
+_SPRITE_MARGIN = 2  # Tile drawings overflow by a pixel or two, onto the next tiles which are blitted later
+_CAR_SPRITE_SIDE = CAR_LENGTH * 2  # Fits the car with its lights at any angle
+_CAR_SPRITES = 2 ** 14  # Cached, by angle, lights and how the fractional position floors the shapes
+
+
+class CarSprite(NamedTuple):
+    surface: Surface  # COLOR_KEY around the car
+    pixels: np.ndarray  # (W, H, 3), of the surface
+    mask: np.ndarray  # (W, H), of the car pixels
+
+
 def _copy_surface(surface: Surface) -> Surface:
     result = pygame.Surface(surface.get_size())
     result.fill(COLOR_KEY)
@@ -66,8 +83,8 @@ def _draw_filled_pie(surface: Surface, x: int, y: int, outer_radius: int, inner_
     pygame.draw.polygon(surface, color, points)
 
 
-def _draw_granules(surface: Surface, color: Color, rect: Rectangle, shape: Shape = None):
-    x, y, width, height = rect
+def _draw_granules(surface: Surface, color: Color, rect: Rectangle, random: np.random.Generator, shape: Shape = None):
+    x, y, width, height = (int(value) for value in rect)
 
     if shape == "┌":
         center = (x + width, y + height)
@@ -80,29 +97,39 @@ def _draw_granules(surface: Surface, color: Color, rect: Rectangle, shape: Shape
     else:
         center = None
 
-    def distance(position: Vector) -> int:
-        return int(math.sqrt((granule_x - position[0]) ** 2 + (granule_y - position[1]) ** 2))
-
-    granules = int(width * height // 100)
-    for _ in range(granules):
-
-        granule_x = x + random.randint(0, width)
-        granule_y = y + random.randint(0, height)
-
-        if not center or distance(center) < width:
-            pygame.draw.circle(surface, color, (granule_x, granule_y), 1)
-
-
-def _draw_grass(surface: Surface):
-    for x in range(surface.get_width()):
-        for y in range(surface.get_height()):
-            color = GREEN if y % 2 == 0 else DARK_GREEN
-            grass_y = y + random.randint(-5, 5)
-            pygame.draw.line(surface, color, (x, y), (x, grass_y), 1)
-
-
-def _draw_asphalt(surface: Surface, tile: Vector, shape: Shape):
-    x, y = get_tile_position(tile)
+    granules = width * height // 100
+    granule_x = x + random.integers(0, width, granules, endpoint=True)
+    granule_y = y + random.integers(0, height, granules, endpoint=True)
+    if center:
+        distance = np.sqrt((granule_x - center[0]) ** 2 + (granule_y - center[1]) ** 2).astype(int)
+        granule_x, granule_y = granule_x[distance < width], granule_y[distance < width]
+
+    # pygame.draw.circle(..., radius=1) fills the 2×2 pixels up and left of the center
+    pixels_x = (granule_x[:, None] + (-1, -1, 0, 0)).ravel()
+    pixels_y = (granule_y[:, None] + (-1, 0, -1, 0)).ravel()
+    inside = (0 <= pixels_x) & (pixels_x < surface.get_width()) & (0 <= pixels_y) & (pixels_y < surface.get_height())
+    pixels = pygame.surfarray.pixels3d(surface)
+    pixels[pixels_x[inside], pixels_y[inside]] = (color.r, color.g, color.b)
+    del pixels  # Unlocks the surface
+
+
+def _get_grass(area: Vector, random: np.random.Generator) -> np.ndarray:
+    # (W, H, 3), as if every pixel drew a vertical line of its row's color up or down to _GRASS_LENGTH pixels,
+    # in top to bottom order, so each pixel shows the lowest line covering it, which is never one from above
+    width, height = area
+    lengths = random.integers(-_GRASS_LENGTH, _GRASS_LENGTH, (width, height), endpoint=True)
+    y = np.arange(height)
+    source = np.broadcast_to(y, (width, height))
+    for offset in range(1, _GRASS_LENGTH + 1):  # Lines starting below and reaching up, the lowest one last
+        start = np.minimum(y + offset, height - 1)
+        covers = (y + offset < height) & (lengths[:, start] <= -offset)
+        source = np.where(covers, y + offset, source)
+    colors = np.array([(color.r, color.g, color.b) for color in (GREEN, DARK_GREEN)], dtype=np.uint8)
+    return colors[source % 2]
+
+
+def _draw_asphalt(surface: Surface, position: Vector, shape: Shape, random: np.random.Generator):
+    x, y = position
 
     if shape == "┌":
         pygame.draw.rect(surface, GRAY, (x, y + SIDE - PAD, SIDE, PAD))
@@ -123,11 +150,11 @@ def _draw_asphalt(surface: Surface, tile: Vector, shape: Shape):
     else:
         pygame.draw.rect(surface, GRAY, (x, y, SIDE, SIDE))
 
-    _draw_granules(surface, LIGHT_GRAY, (x, y, SIDE, SIDE), shape)
+    _draw_granules(surface, LIGHT_GRAY, (x, y, SIDE, SIDE), random, shape)
 
 
-def _draw_pavement(surface: Surface, tile: Vector, shape: Shape):
-    x, y = get_tile_position(tile)
+def _draw_pavement(surface: Surface, position: Vector, shape: Shape, random: np.random.Generator):
+    x, y = position
     if shape == "─":
         pygame.draw.rect(surface, DARK_GRAY, (x, y, SIDE, PAD))
         pygame.draw.rect(surface, DARK_GRAY, (x, y + SIDE - PAD, SIDE, PAD))
@@ -177,7 +204,7 @@ def _draw_pavement(surface: Surface, tile: Vector, shape: Shape):
         _draw_filled_pie(surface, x, y, PAD, 0, 0, 90, DARK_GRAY)
     else:
         pass
-    _draw_granules(surface, LIGHT_GRAY, (x, y, SIDE, SIDE), shape)
+    _draw_granules(surface, LIGHT_GRAY, (x, y, SIDE, SIDE), random, shape)
 
 
 def _draw_navigation(surface: Surface, tile: Vector, direction: Vector, shape: Shape):
@@ -216,7 +243,7 @@ def _draw_navigation(surface: Surface, tile: Vector, direction: Vector, shape: S
         pass
 
 
-def _draw_crosswalks(surface: Surface, tile: Vector, shape: Shape):
+def _draw_crosswalks(surface: Surface, position: Vector, shape: Shape, random: np.random.Generator):
     def _draw_single(area: Rectangle, size: Vector, offset: Vector):
         area_x, area_y, area_width, area_height = area
 
@@ -224,11 +251,11 @@ def _draw_crosswalks(surface: Surface, tile: Vector, shape: Shape):
         width, height = size
         while x < (area_x + area_width) and y < (area_y + area_height):
             pygame.draw.rect(surface, LIGHTEST_GRAY, (x, y, width, height))
-            _draw_granules(surface, LIGHT_GRAY, (x, y, width, height))
+            _draw_granules(surface, LIGHT_GRAY, (x, y, width, height), random)
             x += offset[0]
             y += offset[1]
 
-    tile_x, tile_y = get_tile_position(tile)
+    tile_x, tile_y = position
     if shape in "┤┬┴┼":  # Left crosswalk
         _draw_single((tile_x, tile_y + PAD * 1.25, PAD, SIDE - PAD * 2), (PAD, PAD / 2), (0, PAD))
     if shape in "├┤┴┼":  # Top crosswalk
@@ -239,8 +266,8 @@ def _draw_crosswalks(surface: Surface, tile: Vector, shape: Shape):
         _draw_single((tile_x + PAD * 1.25, tile_y + SIDE - PAD, SIDE - PAD * 2, PAD), (PAD / 2, PAD), (PAD, 0))
 
 
-def _draw_centerline(surface: Surface, tile: Vector, shape: Shape):
-    x, y = get_tile_position(tile)
+def _draw_centerline(surface: Surface, position: Vector, shape: Shape):
+    x, y = position
     if shape == "─":
         pygame.draw.line(surface, CENTERLINE, (x, y + HALF), (x + SIDE, y + HALF), 2)
     elif shape == "│":
@@ -269,31 +296,112 @@ def _draw_centerline(surface: Surface, tile: Vector, shape: Shape):
         pass
 
 
-def _draw_background(surface: Surface):
-    _draw_grass(surface)
+def _draw_tile(surface: Surface, position: Vector, shape: Shape, random: np.random.Generator):
+    _draw_asphalt(surface, position, shape, random)
+    _draw_pavement(surface, position, shape, random)
+    _draw_centerline(surface, position, shape)
+    _draw_crosswalks(surface, position, shape, random)
+
+
+@cache
+def _get_tile_sprite(shape: Shape, seed: int) -> Surface:
+    # Drawn once per shape with its own granules, COLOR_KEY where the grass shows through
+    size = SIDE + _SPRITE_MARGIN * 2
+    result = pygame.Surface((size, size))
+    result.fill(COLOR_KEY)
+    result.set_colorkey(COLOR_KEY)
+    _draw_tile(result, (_SPRITE_MARGIN, _SPRITE_MARGIN), shape, np.random.default_rng([seed, ord(shape)]))
+    return result
+
+
+@clone
+def get_background() -> Surface:
+    return _get_shared_background()
+
+
+@cache
+def _get_shared_background() -> Surface:
+    # Shared by all callers, only blitted from, never drawn on
+    return pygame.surfarray.make_surface(get_background_array())
+
+
+def get_background_array() -> np.ndarray:
+    return _load_background_cache()["background"]  # (W, H, 3)
+
+
+def get_obstacle_mask() -> np.ndarray:
+    return _load_background_cache()["obstacle_mask"]  # (W, H)
+
 
+def render_background_array(seed: int = _BACKGROUND_SEED) -> np.ndarray:
+    surface = pygame.surfarray.make_surface(_get_grass(CANVAS_AREA, np.random.default_rng(seed)))
     for tile_row, row in enumerate(ROAD_MAP):
         for tile_col, shape in enumerate(row):
             if shape == " ":
                 continue
 
-            tile = (tile_col, tile_row)
-            _draw_asphalt(surface, tile, shape)
-            _draw_pavement(surface, tile, shape)
-            _draw_centerline(surface, tile, shape)
-            _draw_crosswalks(surface, tile, shape)
+            x, y = get_tile_position((tile_col, tile_row))
+            surface.blit(_get_tile_sprite(shape, seed), (x - _SPRITE_MARGIN, y - _SPRITE_MARGIN))
+    return pygame.surfarray.array3d(surface)  # (W, H, 3)
+
+
+def _to_obstacle_mask(pixels: np.ndarray) -> np.ndarray:
+    # (W, H), pixels the car must not touch: pavement and centerline
+    result = np.zeros(pixels.shape[:2], dtype=bool)
+    for color in [DARK_GRAY, CENTERLINE]:
+        result |= np.all(pixels == (color.r, color.g, color.b), axis=2)
+    return result
 
 
-@clone
 @cache
-def get_background() -> Surface:
-    result: Surface = pygame.Surface(CANVAS_AREA)
-    _draw_background(result)
+def _load_background_cache() -> dict:
+    # Both arrays at once, so the background is rendered at most once per process
+    path = _get_background_cache_path()
+    if path and os.path.exists(path):
+        with np.load(path) as arrays:
+            return dict(arrays)
+
+    background = render_background_array()
+    result = {"background": background, "obstacle_mask": _to_obstacle_mask(background)}
+    if path:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Written aside and renamed, as rollout workers and sweep runs may render concurrently
+        file, temporary_path = tempfile.mkstemp(suffix=".npz", dir=os.path.dirname(path))
+        with os.fdopen(file, "wb") as output:
+            np.savez(output, **result)
+        os.replace(temporary_path, path)
     return result
 
 
-def draw_car(surface: Surface, car: CarState, previous_car: CarState = None) -> Surface:
-    car_x, car_y = car.position
+def _get_background_cache_path() -> str:
+    # Empty BACKGROUND_CACHE_PATH disables the cache
+    directory = os.environ.get("BACKGROUND_CACHE_PATH", os.path.join(os.path.expanduser("~"), ".cache", "rl-car-2d"))
+    if not directory:
+        return ""
+
+    # Keyed by everything the pixels depend on, including the drawing code of this module and its map helpers
+    key = hashlib.sha256()
+    key.update(repr(ROAD_MAP).encode())
+    key.update(repr(sorted((name, repr(value)) for name, value in vars(constants).items() if name.isupper())).encode())
+    key.update(str(_BACKGROUND_SEED).encode())
+    for path in [__file__, map_util.__file__, shapes.__file__, math_util.__file__]:
+        with open(path, "rb") as source:
+            key.update(source.read())
+    return os.path.join(directory, f"background_{key.hexdigest()[:16]}.npz")
+
+
+def get_car_shapes(car: CarState) -> Tuple[Sequence[Vector], Sequence[Vector], List[Tuple[Color, Vector]]]:
+    blink = car.events.crossroad.blink if car.events.crossroad else Blink.NONE
+    return _get_car_shapes(car.position, car.angle, blink, car.decelerating)
+
+
+def _get_car_shapes(
+        position: Vector,
+        angle: AngleDegrees,
+        blink: Blink,
+        decelerating: bool,
+) -> Tuple[Sequence[Vector], Sequence[Vector], List[Tuple[Color, Vector]]]:
+    car_x, car_y = position
 
     # Body
     body_corners = [
@@ -307,8 +415,7 @@ def draw_car(surface: Surface, car: CarState, previous_car: CarState = None) ->
         (car_x - CAR_LENGTH / 2, car_y - CAR_WIDTH / 2 + CAR_WIDTH / 8 * 2),
         (car_x - CAR_LENGTH / 2 + CAR_LENGTH / 16 * 2, car_y - CAR_WIDTH / 2),
     ]
-    rotated_body_corners = rotate_polygon(body_corners, car.angle, (car_x, car_y))
-    pygame.draw.polygon(surface, WHITE, rotated_body_corners)
+    rotated_body_corners = rotate_polygon(body_corners, angle, (car_x, car_y))
 
     # Window
     blink_corners = [
@@ -319,36 +426,102 @@ def draw_car(surface: Surface, car: CarState, previous_car: CarState = None) ->
         (car_x - CAR_LENGTH / 2 + CAR_LENGTH / 16 * 11, car_y - CAR_WIDTH / 2 + CAR_WIDTH / 8 * 7.0),
         (car_x - CAR_LENGTH / 2 + CAR_LENGTH / 16 * 2, car_y - CAR_WIDTH / 2 + CAR_WIDTH / 8 * 6),
     ]
-    rotated_window_corners = rotate_polygon(blink_corners, car.angle, (car_x, car_y))
-    pygame.draw.polygon(surface, LIGHT_BLACK, rotated_window_corners)
+    rotated_window_corners = rotate_polygon(blink_corners, angle, (car_x, car_y))
 
     # Blink
-    lights: List[Tuple[int, Vector]] = []
-    if car.events.crossroad:
-        if car.events.crossroad.blink == Blink.LEFT:
-            lights.append((TURN_SIGNAL, (car_x - CAR_LENGTH / 2 + CAR_LENGTH / 16 * 1, car_y - CAR_WIDTH / 2)))
-            lights.append((TURN_SIGNAL, (car_x - CAR_LENGTH / 2 + CAR_LENGTH / 16 * 15, car_y - CAR_WIDTH / 2)))
-        elif car.events.crossroad.blink == Blink.RIGHT:
-            lights.append((TURN_SIGNAL, (car_x - CAR_LENGTH / 2 + CAR_LENGTH / 16 * 15, car_y + CAR_WIDTH / 2)))
-            lights.append((TURN_SIGNAL, (car_x - CAR_LENGTH / 2 + CAR_LENGTH / 16 * 1, car_y + CAR_WIDTH / 2)))
-    if car.decelerating:
+    lights: List[Tuple[Color, Vector]] = []
+    if blink == Blink.LEFT:
+        lights.append((TURN_SIGNAL, (car_x - CAR_LENGTH / 2 + CAR_LENGTH / 16 * 1, car_y - CAR_WIDTH / 2)))
+        lights.append((TURN_SIGNAL, (car_x - CAR_LENGTH / 2 + CAR_LENGTH / 16 * 15, car_y - CAR_WIDTH / 2)))
+    elif blink == Blink.RIGHT:
+        lights.append((TURN_SIGNAL, (car_x - CAR_LENGTH / 2 + CAR_LENGTH / 16 * 15, car_y + CAR_WIDTH / 2)))
+        lights.append((TURN_SIGNAL, (car_x - CAR_LENGTH / 2 + CAR_LENGTH / 16 * 1, car_y + CAR_WIDTH / 2)))
+    if decelerating:
         lights.append((RED, (car_x - CAR_LENGTH / 2 + CAR_LENGTH / 16 * 0, car_y - CAR_WIDTH / 2 + 1)))
         lights.append((RED, (car_x - CAR_LENGTH / 2 + CAR_LENGTH / 16 * 0, car_y + CAR_WIDTH / 2 - 1)))
+    rotated_lights = [(color, rotate(light, angle, (car_x, car_y))) for color, light in lights]
 
-    for color, position in lights:
-        rotated = rotate(position, car.angle, (car_x, car_y))
-        pygame.draw.circle(surface, color, rotated, 2)
+    return rotated_body_corners, rotated_window_corners, rotated_lights
 
+
+def draw_car(surface: Surface, car: CarState, previous_car: CarState = None) -> Surface:
+    _blit_car(surface, car)
     return surface
 
 
+def _blit_car(surface: Surface, car: CarState) -> Rect:
+    # Returns the area drawn on, clipped to the surface
+    sprite, position = get_car_sprite(car)
+    return surface.blit(sprite.surface, position)
+
+
+def get_car_sprite(car: CarState) -> Tuple[CarSprite, Tuple[int, int]]:
+    # Sprite of the car and where to blit it. pygame floors the coordinates it draws at, so sprites are keyed by
+    # the floored shapes relative to the floored car position, the same pixels as drawing the car at its position
+    origin = (math.floor(car.position[0]), math.floor(car.position[1]))
+    body_corners, window_corners, lights = get_car_shapes(car)
+    sprite = _get_car_sprite(
+        _to_sprite_points(body_corners, origin),
+        _to_sprite_points(window_corners, origin),
+        tuple((tuple(color), *_to_sprite_points([light], origin)) for color, light in lights),
+    )
+    return sprite, (origin[0] - _CAR_SPRITE_SIDE // 2, origin[1] - _CAR_SPRITE_SIDE // 2)
+
+
+def _to_sprite_points(points: Sequence[Vector], origin: Tuple[int, int]) -> Tuple[Tuple[int, int], ...]:
+    origin_x, origin_y = origin
+    return tuple(
+        (math.floor(x) - origin_x + _CAR_SPRITE_SIDE // 2, math.floor(y) - origin_y + _CAR_SPRITE_SIDE // 2)
+        for x, y in points
+    )
+
+
+@lru_cache(maxsize=_CAR_SPRITES)
+def _get_car_sprite(
+        body_corners: Tuple[Tuple[int, int], ...],
+        window_corners: Tuple[Tuple[int, int], ...],
+        lights: Tuple[Tuple[Tuple[int, ...], Tuple[int, int]], ...],
+) -> CarSprite:
+    surface = pygame.Surface((_CAR_SPRITE_SIDE, _CAR_SPRITE_SIDE))
+    surface.fill(COLOR_KEY)
+    surface.set_colorkey(COLOR_KEY)
+
+    pygame.draw.polygon(surface, WHITE, body_corners)
+    pygame.draw.polygon(surface, LIGHT_BLACK, window_corners)
+    for color, light in lights:
+        pygame.draw.circle(surface, color, light, 2)
+
+    pixels = pygame.surfarray.array3d(surface)
+    mask = np.any(pixels != (COLOR_KEY.r, COLOR_KEY.g, COLOR_KEY.b), axis=2)
+    return CarSprite(surface, pixels, mask)
+
+
 def draw_state(surface: Surface, car: CarState, previous_car: CarState = None) -> Surface:
-    background: Surface = get_background()
-    surface.blit(background, (0, 0))
+    surface.blit(_get_shared_background(), (0, 0))
     draw_car(surface, car, previous_car)
     return surface
 
 
+class Canvas:
+    # Persistent surface redrawn incrementally, the same pixels as draw_state() and draw_car() on a new surface.
+    # Only the areas cars were drawn on since the last draw_state() are restored from the background
+    def __init__(self):
+        self.surface = pygame.Surface(CANVAS_AREA)
+        self.surface.blit(_get_shared_background(), (0, 0))
+        self._dirty: List[Rect] = []
+
+    def draw_state(self, car: CarState, previous_car: CarState = None) -> Surface:
+        background = _get_shared_background()
+        for rect in self._dirty:
+            self.surface.blit(background, rect, rect)
+        self._dirty.clear()
+        return self.draw_car(car, previous_car)
+
+    def draw_car(self, car: CarState, previous_car: CarState = None) -> Surface:
+        self._dirty.append(_blit_car(self.surface, car))
+        return self.surface
+
+
 def draw_stats(
         surface: Surface,
         car: CarState,
@@ -1,4 +1,6 @@
 import os
+import threading
+from typing import Optional, Any, NamedTuple
 
 import pygame
 from pygame import Surface
@@ -10,6 +12,45 @@ from rl.apps.car.helpers.canvas import draw_observation, draw_stats
 from rl.apps.car.helpers.keyboard import Keyboard
 
 
+class _Snapshot(NamedTuple):
+    state: State  # With its own copy of the view, as environments draw on theirs incrementally
+    observation: Observation
+    epoch: int
+    batch: int
+    episode: int
+
+
+class _LatestSlot:
+    # Single slot queue, put() replaces an unconsumed value instead of blocking
+    def __init__(self):
+        self._value: Optional[Any] = None
+        self._waiting = False
+        self._condition = threading.Condition()
+
+    def put(self, value: Any):
+        with self._condition:
+            self._value = value
+            self._condition.notify()
+
+    def get(self) -> Any:
+        with self._condition:
+            self._waiting = True
+            self._condition.wait_for(lambda: self._value is not None)
+            self._waiting = False
+            value, self._value = self._value, None
+            return value
+
+    def is_waiting(self) -> bool:
+        # Whether a consumer is blocked in get(), so a put() value would not be replaced unconsumed
+        with self._condition:
+            return self._waiting
+
+    def poll(self) -> Optional[Any]:
+        with self._condition:
+            value, self._value = self._value, None
+            return value
+
+
 class Display:
     def __init__(self, keyboard: Keyboard):
         self._display: Surface = pygame.display.set_mode(DISPLAY_AREA)
@@ -18,6 +59,14 @@ class Display:
         self._render = os.environ.get("DISPLAY_RENDER", "false").lower() == "true"
         self._fast_render = os.environ.get("FAST_RENDER", "false").lower() == "true"
 
+        # Frames are composed by a renderer thread at its own frame rate, dropping snapshots it is too slow for.
+        # It blits, draws and renders fonts on surfaces of its own, which pygame allows off the main thread.
+        # Only the window calls stay on this thread, as some platforms require them on the main one
+        self._snapshots = _LatestSlot()
+        self._frames = _LatestSlot()
+        self._renderer_error: Optional[Exception] = None  # Raised by the next step(), the renderer stops on it
+        threading.Thread(target=self._run_renderer, name="display-renderer", daemon=True).start()
+
     def step(
             self,
             state: State,
@@ -26,16 +75,18 @@ class Display:
             batch: int,
             episode: int,
     ):
+        if self._renderer_error is not None:
+            raise RuntimeError("Display renderer failed") from self._renderer_error
+
         if self._render:
-            # Compose visible surface
-            canvas: Surface = pygame.Surface(CANVAS_AREA)
-            canvas.blit(state.view, (0, 0))
-            draw_stats(canvas, state.car, self._fast_render, epoch, batch, episode)
-            if not self._fast_render:
-                draw_observation(canvas, observation.view)
+            if self._snapshots.is_waiting():  # Otherwise the renderer is busy and would drop it, so skip the copy
+                state = State(state.car, state.view.copy())
+                self._snapshots.put(_Snapshot(state, observation, epoch, batch, episode))
 
-            self._display.blit(canvas, CANVAS_TO_DISPLAY_OFFSET)
-            pygame.display.flip()
+            # Show the latest composed frame, if any
+            if canvas := self._frames.poll():
+                self._display.blit(canvas, CANVAS_TO_DISPLAY_OFFSET)
+                pygame.display.flip()
 
         # Handle pygame events
         for event in pygame.event.get():
@@ -48,6 +99,27 @@ class Display:
         if self._keyboard.is_pressed([pygame.K_f]):
             self._fast_render = not self._fast_render
 
-        # Tick
-        if self._render and not self._fast_render:
-            self._clock.tick(FRAMES_PER_SECOND)
+    def _run_renderer(self):
+        try:
+            while True:
+                snapshot: _Snapshot = self._snapshots.get()
+                fast_render = self._fast_render
+                self._frames.put(self._compose(snapshot, fast_render))
+
+                # Tick
+                if not fast_render:
+                    self._clock.tick(FRAMES_PER_SECOND)
+        except Exception as error:
+            self._renderer_error = error
+
+    @staticmethod
+    def _compose(snapshot: _Snapshot, fast_render: bool) -> Surface:
+        canvas: Surface = pygame.Surface(CANVAS_AREA)
+        canvas.blit(snapshot.state.view, (0, 0))
+        draw_stats(canvas, snapshot.state.car, fast_render, snapshot.epoch, snapshot.batch, snapshot.episode)
+        if not fast_render:
+            view = snapshot.observation.view
+            if not isinstance(view, Surface):
+                view = pygame.surfarray.make_surface(view)
+            draw_observation(canvas, view)
+        return canvas
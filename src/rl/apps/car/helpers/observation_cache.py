@@ -0,0 +1,62 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional, Tuple, Hashable
+
+from torch import Tensor
+
+from rl.apps.car.environment.car import CarState
+
+
+@dataclass
+class ObservationCacheParams:
+    max_bytes: int = 256 * 2 ** 20
+    position_quantum: float = 0.  # Pixels, poses within it share observations, 0 for exact positions only
+    angle_quantum: float = 0.  # °, 0 for exact angles only
+
+
+class ObservationCache:
+    # Least recently used observation pixels by what they depend on: car pose, turn signal and brake lights
+    def __init__(self, params: ObservationCacheParams):
+        self.params = params
+        self.hits = 0
+        self.misses = 0
+        self._pixels: "OrderedDict[Hashable, Tensor]" = OrderedDict()
+        self._bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._pixels)
+
+    def get(self, car: CarState) -> Optional[Tensor]:
+        key = self._to_key(car)
+        pixels = self._pixels.get(key)
+        if pixels is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._pixels.move_to_end(key)
+        return pixels
+
+    def put(self, car: CarState, pixels: Tensor):
+        key = self._to_key(car)
+        if key in self._pixels:
+            return
+        self._pixels[key] = pixels
+        self._bytes += pixels.nelement() * pixels.element_size()
+        while self._bytes > self.params.max_bytes and self._pixels:
+            _, evicted = self._pixels.popitem(last=False)
+            self._bytes -= evicted.nelement() * evicted.element_size()
+
+    def _to_key(self, car: CarState) -> Tuple:
+        x, y = car.position
+        blink = car.events.crossroad.blink if car.events.crossroad else None
+        return (
+            _quantize(x, self.params.position_quantum),
+            _quantize(y, self.params.position_quantum),
+            _quantize(car.angle, self.params.angle_quantum),
+            blink,
+            car.decelerating,
+        )
+
+
+def _quantize(value: float, quantum: float) -> float:
+    return round(value / quantum) if quantum else value
@@ -0,0 +1,222 @@
+import dataclasses
+from dataclasses import dataclass
+from typing import List, Optional, Tuple, Dict
+
+import numpy as np
+import pygame
+import torch
+import torch.multiprocessing as multiprocessing
+from pygame import Surface
+from torch import Tensor, nn
+
+from rl.apps.car.environment.car import Action
+from rl.apps.car.environment.environment import Observation
+from rl.apps.car.environment.rl import RlEnvironmentMode, RlEnvironment, get_reset_chains
+from rl.apps.car.helpers.observation_cache import ObservationCache, ObservationCacheParams
+from rl.apps.car.model.inference import Inference
+from rl.apps.car.model.model import SelfDrivingCarModelParams, SelfDrivingCarModel, ObservationTensors, \
+    stack_observations
+from rl.apps.car.model.rl import RlModel
+from rl.apps.car.utils.timers import timer, add_timers, reset_timers, get_timers
+
+
+@dataclass
+class Rollout:
+    observations: ObservationTensors  # Stacked, (T, ...)
+    actions: List[int]
+    rewards: List[float]
+
+
+@dataclass
+class _RolloutTask:
+    reset_index: int
+    batches: int
+    seed: int
+
+
+@dataclass
+class _RolloutWorker:
+    policy: nn.Module  # In shared memory, updated in place by the trainer process
+    model: RlModel
+    environment_mode: RlEnvironmentMode
+    total_resets: int
+    max_episodes: int
+    observation_cache: Optional[ObservationCache]  # Kept over epochs, as observations do not depend on the policy
+
+
+_worker: Optional[_RolloutWorker] = None
+
+
+class RolloutPool:
+    def __init__(
+            self,
+            workers: int,
+            model_params: SelfDrivingCarModelParams,
+            environment_mode: RlEnvironmentMode,
+            total_resets: int,
+            max_episodes: int,
+            inference: Inference = Inference.EAGER,
+            compile_model: bool = False,
+            observation_cache: Optional[ObservationCacheParams] = None,
+    ):
+        self.environment_mode = environment_mode
+        self.total_resets = total_resets
+        self.cache_hits = 0  # Of the observation caches in the last run
+        self.cache_misses = 0
+
+        model_params = dataclasses.replace(model_params, state_path=None)  # Weights come from the trainer
+        self._policy = SelfDrivingCarModel(model_params).share_memory()
+        self._pool = multiprocessing.get_context("spawn").Pool(
+            processes=workers,
+            initializer=_init_worker,
+            initargs=(
+                self._policy,
+                model_params,
+                environment_mode,
+                total_resets,
+                max_episodes,
+                inference,
+                compile_model,
+                observation_cache,
+            ),
+        )
+
+    def run(self, module: nn.Module) -> List[Rollout]:
+        self._policy.load_state_dict(module.state_dict())
+        tasks = [
+            _RolloutTask(reset_index, batches, int(torch.randint(2 ** 31, ())))
+            for reset_index, batches in get_reset_chains(self.environment_mode, self.total_resets)
+        ]
+        result = []
+        self.cache_hits, self.cache_misses = 0, 0
+        for rollouts, timers, (cache_hits, cache_misses) in self._pool.map(_run_task, tasks, chunksize=1):
+            result += rollouts
+            add_timers(timers)  # Summed over workers, so can exceed the elapsed time
+            self.cache_hits += cache_hits
+            self.cache_misses += cache_misses
+        return result
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
+
+    def __enter__(self) -> "RolloutPool":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._pool.terminate()
+
+
+def to_observation_tensors(observation: Observation) -> ObservationTensors:
+    return ObservationTensors(_to_pixels(observation), _to_scalars(observation))  # Normalized by the model
+
+
+def _to_pixels(observation: Observation) -> Tensor:
+    def surface_to_tensor(surface: Surface) -> Tensor:
+        flat = np.frombuffer(pygame.image.tostring(surface, "RGB"), dtype=np.uint8)
+        shape = (surface.get_height(), surface.get_width(), 3)
+        as_array = np.transpose(flat.reshape(shape), (2, 1, 0))  # (3, W, H)
+        return torch.from_numpy(as_array.copy())
+
+    def pixels_to_tensor(pixels: np.ndarray) -> Tensor:
+        as_array = np.transpose(pixels, (2, 0, 1))  # (3, W, H)
+        return torch.from_numpy(as_array.copy())
+
+    if isinstance(observation.view, Surface):
+        return surface_to_tensor(observation.view)
+    return pixels_to_tensor(observation.view)
+
+
+def _to_scalars(observation: Observation) -> Tensor:
+    return torch.tensor([observation.car.speed, observation.car.turn], dtype=torch.float32)
+
+
+def _init_worker(
+        policy: nn.Module,
+        model_params: SelfDrivingCarModelParams,
+        environment_mode: RlEnvironmentMode,
+        total_resets: int,
+        max_episodes: int,
+        inference: Inference,
+        compile_model: bool,
+        observation_cache: Optional[ObservationCacheParams],
+):
+    global _worker
+    torch.set_num_threads(1)  # Parallelism comes from the workers
+    _worker = _RolloutWorker(
+        policy=policy,
+        model=RlModel(
+            SelfDrivingCarModel(model_params),
+            dry_run=True,
+            learning_rate=0.,
+            weight_decay=0.,
+            inference=inference,
+            compile_model=compile_model,
+        ),
+        environment_mode=environment_mode,
+        total_resets=total_resets,
+        max_episodes=max_episodes,
+        observation_cache=ObservationCache(observation_cache) if observation_cache else None,
+    )
+
+
+def _run_task(task: _RolloutTask) -> Tuple[List[Rollout], Dict[str, float], Tuple[int, int]]:
+    reset_timers()
+    cache = _worker.observation_cache
+    cache_hits, cache_misses = (cache.hits, cache.misses) if cache is not None else (0, 0)
+    torch.manual_seed(task.seed)
+    _worker.model.load_state_dict(_worker.policy.state_dict())
+    environment = RlEnvironment(
+        mode=_worker.environment_mode,
+        total_resets=_worker.total_resets,
+        reset_index=task.reset_index,
+        render=cache is None,
+        view=False,
+    )
+    rollouts = [_run_batch(environment) for _ in range(task.batches)]
+    if cache is not None:
+        cache_hits, cache_misses = cache.hits - cache_hits, cache.misses - cache_misses
+    return rollouts, get_timers(), (cache_hits, cache_misses)
+
+
+def _run_batch(environment: RlEnvironment) -> Rollout:
+    observations: List[ObservationTensors] = []
+    actions: List[int] = []
+    rewards: List[float] = []
+
+    _, observation = environment.reset()
+    for episode in range(_worker.max_episodes):
+        observation = _get_observation_tensors(environment, observation)
+        observations += [observation]
+
+        with timer("act"):
+            action = _worker.model.act(observation)
+        actions += [action]
+
+        _, observation, reward, done = environment.step(Action(action))
+        rewards += [reward]
+
+        if done:
+            break
+
+    # One tensor per batch and field, moved into shared memory when sent back to the trainer process
+    return Rollout(stack_observations(observations), actions, rewards)
+
+
+def _get_observation_tensors(environment: RlEnvironment, observation: Observation) -> ObservationTensors:
+    cache = _worker.observation_cache
+    if cache is None:
+        with timer("tensors"):
+            return to_observation_tensors(observation)
+
+    # Not rendered by the environment, only on cache misses
+    pixels = cache.get(environment.state.car)
+    if pixels is None:
+        observation = environment.render()
+        with timer("tensors"):
+            pixels = _to_pixels(observation)
+        cache.put(environment.state.car, pixels)
+    return ObservationTensors(pixels, _to_scalars(observation))
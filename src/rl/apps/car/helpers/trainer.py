@@ -1,44 +1,74 @@
+import contextlib
 import csv
 import io
 import json
 import os
 import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from dataclasses import dataclass
-from typing import List, Optional, Collection
+from typing import List, Optional, Collection, ContextManager, Dict
 
 import numpy as np
 import pygame
 import torch
+import torch.multiprocessing as multiprocessing
 from cattr import unstructure
-from pygame import Surface
 from torch import Tensor
 
-from rl.apps.car.common.constants import CAR_MIN_SPEED, CAR_MAX_SPEED, CAR_MIN_TURN, CAR_MAX_TURN
+from rl.apps.car.common.constants import CAR_MAX_SPEED
 from rl.apps.car.environment.car import Action
-from rl.apps.car.environment.environment import Observation
 from rl.apps.car.environment.rl import RlEnvironmentMode, RlEnvironment
 from rl.apps.car.helpers.display import Display
 from rl.apps.car.helpers.keyboard import Keyboard
-from rl.apps.car.model.model import SelfDrivingCarModelParams, SelfDrivingCarModel
+from rl.apps.car.helpers.observation_cache import ObservationCacheParams
+from rl.apps.car.helpers.rollout import RolloutPool, to_observation_tensors
+from rl.apps.car.model.buffer import RolloutBuffer
+from rl.apps.car.model.inference import Inference
+from rl.apps.car.model.model import SelfDrivingCarModelParams, SelfDrivingCarModel, ObservationTensors
 from rl.apps.car.model.rl import RlModel
 from rl.apps.car.utils.device import to_device
-from rl.apps.car.utils.files import move_files, save_state, save_file
-from rl.apps.car.utils.tee import capture_stdout
+from rl.apps.car.utils.files import move_files, save_file, CheckpointWriter
+from rl.apps.car.utils.math_util import discounted_reverse_cumsum
+from rl.apps.car.utils.tee import capture_stdout, prefix_stdout
+from rl.apps.car.utils.timers import timer, reset_timers, get_timers
 from rl.apps.car.utils.timestamp import get_timestamp
 
 
+_PHASES = [  # Timed phases, environment stepping is split into car, canvas, observation and collision
+    "keyboard", "display", "car", "canvas", "observation", "collision", "tensors", "act", "weights", "backprop",
+]
+
+
 class Metrics:
     def __init__(self):
         self.max_reward = 0.
         self.max_loss = 0.
         self.improvements = 0
         self.took = 0.
+        self.phases = {phase: 0. for phase in _PHASES}
 
-    def update(self, reward: float, loss: float, improvements: int, took: float):
+    def update(
+            self,
+            reward: float,
+            loss: float,
+            improvements: int,
+            took: float,
+            phases: Optional[Dict[str, float]] = None,
+    ):
         self.max_reward = max(self.max_reward, reward)
         self.max_loss = max(self.max_loss, loss)
         self.improvements = max(self.improvements, improvements)
         self.took += took
+        for phase, seconds in (phases or {}).items():
+            if phase in self.phases:
+                self.phases[phase] += seconds
+
+    def to_phases_label(self) -> str:
+        return " ".join(f"{phase} {seconds:.1f}s" for phase, seconds in self.phases.items())
+
+
+_LABEL_FIELDS = ["ret", "imp", "ts"]
+_DIVERGENCE_OBSERVATIONS = 256  # Of the epoch, to check the acting model against the trained one
 
 
 class HyperParamsOutput(dict):
@@ -66,6 +96,20 @@ class HyperParams:
     environment_mode: RlEnvironmentMode
     model: SelfDrivingCarModelParams
     epoch_state_reward_threshold: int
+    rollout_workers: int = 0  # Worker processes collecting batches, 0 to collect in this process with display
+    backprop_chunk_size: Optional[int] = None  # Max observations per backprop chunk, at least 3, None for all
+    reward_to_go_discount: Optional[float] = None  # Weights steps by discounted reward to go, None by step reward
+    states_keep_top: Optional[int] = 5  # States kept with the best rewards, besides the latest one, None for all
+    inference: Inference = Inference.EAGER  # Model used to act, rebuilt after every backprop
+    compile_model: bool = False  # torch.compile the model, worth it for long runs only as compiling takes a while
+    observation_cache: Optional[ObservationCacheParams] = None  # Per rollout worker, None for none
+
+    def __post_init__(self):
+        if self.observation_cache is not None and not self.rollout_workers:
+            raise ValueError(
+                "Observation cache is only used by rollout workers (currently 0), "
+                "as collecting in this process displays every state"
+            )
 
     def to_output(self, metrics: Metrics, timestamp: str) -> HyperParamsOutput:
         return HyperParamsOutput({
@@ -74,6 +118,7 @@ class HyperParams:
             "imp": f"{metrics.improvements:5.0f}",
             "loss": f"{metrics.max_loss:5.0f}",
             "took": f"{metrics.took:5.1f}s",
+            **{f"t_{phase}": f"{seconds:5.1f}s" for phase, seconds in metrics.phases.items()},
             "e": f"{self.epochs:4}",
             "b": f"{self.max_batches:3}",
             "ep": f"{self.max_episodes:5}",
@@ -87,37 +132,94 @@ class HyperParams:
         })
 
 
+@dataclass
+class _HyperParamsRun:
+    index: int
+    hyper_params: HyperParams
+    output: HyperParamsOutput
+    log: str
+    out_path: str
+    out_filepaths: List[str]
+
+
 class Trainer:
-    def __init__(self, path: str):
+    def __init__(self, path: str, out_path: Optional[str] = None):
         self._keyboard = Keyboard()
-        self._display = Display(self._keyboard)
-        self._out_path = os.path.join(path, get_timestamp())
-
-    def run_hyper_params_list(self, hyper_param_list: List[HyperParams]):
-        hyper_params_list_metrics = Metrics()
-        outputs: List[HyperParamsOutput] = []
-
-        for index, hyper_params in enumerate(hyper_param_list, start=1):
-            hyper_params_metrics = Metrics()
-            with capture_stdout() as buffer:  # Duplicates all print() output also into buffer
-                print(
-                    f"{get_timestamp()}: Starting hyper params {index}/{len(hyper_param_list)}. "
-                    f"Params: {json.dumps(unstructure(hyper_params))}"
-                )
-                out_filepaths = self._run_hyper_params(hyper_params, hyper_params_metrics, hyper_params_list_metrics)
-
-                output = hyper_params.to_output(hyper_params_metrics, get_timestamp())
-                outputs.append(output)
-                label = output.to_label(["ret", "imp", "ts"])
-                print(f"{get_timestamp()}: Finished hyper params {index}/{len(hyper_param_list)}. Label: '{label}'")
-
-            if not hyper_params.dry_run:
-                # Session
-                log_filepath = save_file(self._out_path, f"log.txt", buffer.get())
-                move_files(out_filepaths + [log_filepath], os.path.join(self._out_path, label))
-
-                # Summary
-                save_file(self._out_path, f"summary.csv", HyperParamsOutput.to_csv(outputs))
+        self._display: Optional[Display] = None  # Opened on first use, not at all when sweeping in processes
+        self._out_path = out_path or os.path.join(path, get_timestamp())
+
+    def run_hyper_params_list(
+            self,
+            hyper_param_list: List[HyperParams],
+            concurrency: int = 1,
+            threads_per_run: Optional[int] = None,
+    ):
+        outputs: Dict[int, HyperParamsOutput] = {}
+
+        if concurrency <= 1:
+            self._get_display()  # Opens the window, for keyboard input even when rollout workers show nothing
+            hyper_params_list_metrics = Metrics()
+            runs = (
+                self._run_hyper_params_logged(index, len(hyper_param_list), hyper_params, hyper_params_list_metrics)
+                for index, hyper_params in enumerate(hyper_param_list, start=1)
+            )
+            for run in runs:
+                self._save_run(run, outputs)
+        else:
+            # Runs in separate processes, each into its own directory until labeled, see _save_run()
+            threads_per_run = threads_per_run or max(1, (os.cpu_count() or 1) // concurrency)
+            with ProcessPoolExecutor(
+                    max_workers=concurrency,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_hyper_params_process,
+                    initargs=(threads_per_run,),
+            ) as executor:
+                futures = [
+                    executor.submit(
+                        _run_hyper_params_process,
+                        os.path.join(self._out_path, f"run{index}"),
+                        index,
+                        len(hyper_param_list),
+                        hyper_params,
+                    )
+                    for index, hyper_params in enumerate(hyper_param_list, start=1)
+                ]
+                for future in as_completed(futures):
+                    self._save_run(future.result(), outputs)
+
+    def _run_hyper_params_logged(
+            self,
+            index: int,
+            total: int,
+            hyper_params: HyperParams,
+            hyper_params_list_metrics: Metrics,
+    ) -> _HyperParamsRun:
+        hyper_params_metrics = Metrics()
+        with capture_stdout() as buffer:  # Duplicates all print() output also into buffer
+            print(
+                f"{get_timestamp()}: Starting hyper params {index}/{total}. "
+                f"Params: {json.dumps(unstructure(hyper_params))}"
+            )
+            out_filepaths = self._run_hyper_params(hyper_params, hyper_params_metrics, hyper_params_list_metrics)
+
+            output = hyper_params.to_output(hyper_params_metrics, get_timestamp())
+            label = output.to_label(_LABEL_FIELDS)
+            print(f"{get_timestamp()}: Finished hyper params {index}/{total}. Label: '{label}'")
+        return _HyperParamsRun(index, hyper_params, output, buffer.get(), self._out_path, out_filepaths)
+
+    def _save_run(self, run: _HyperParamsRun, outputs: Dict[int, HyperParamsOutput]):
+        outputs[run.index] = run.output
+        if not run.hyper_params.dry_run:
+            # Session
+            log_filepath = save_file(run.out_path, f"log.txt", run.log)
+            label = run.output.to_label(_LABEL_FIELDS)  # With the run index, as labels of concurrent runs can be equal
+            move_files(run.out_filepaths + [log_filepath], os.path.join(self._out_path, f"{label} | run {run.index}"))
+            if run.out_path != self._out_path:
+                os.rmdir(run.out_path)
+
+            # Summary
+            summary = HyperParamsOutput.to_csv([outputs[index] for index in sorted(outputs)])
+            save_file(self._out_path, f"summary.csv", summary)
 
     def _run_hyper_params(
             self,
@@ -125,131 +227,154 @@ class Trainer:
             hyper_params_metrics: Metrics,
             hyper_param_list_metrics: Metrics,
     ) -> List[str]:
-        file_paths = []
         model = RlModel(
             module=to_device(SelfDrivingCarModel(hyper_params.model)),
             dry_run=hyper_params.dry_run,
             learning_rate=hyper_params.learning_rate,
             weight_decay=hyper_params.weight_decay,
+            backprop_chunk_size=hyper_params.backprop_chunk_size,
+            inference=hyper_params.inference,
+            compile_model=hyper_params.compile_model,
         )
         improvements = 0
-        for epoch in range(hyper_params.epochs):
-            epoch_start = time.time()
-            epoch_observations: List[List[Tensor]] = []
-            epoch_actions: List[List[int]] = []
-            epoch_rewards: List[List[float]] = []
-            epoch_weights: List[List[float]] = []
-
-            environment = RlEnvironment(
-                mode=hyper_params.environment_mode,
-                total_resets=hyper_params.max_batches,
-            )
-
-            for batch in range(hyper_params.max_batches):
-                batch_observations: List[Tensor] = []
-                batch_actions: List[int] = []
-                batch_rewards: List[float] = []
-
-                state, observation = environment.reset()
-
-                for episode in range(hyper_params.max_episodes):
-                    self._keyboard.step()
-                    self._display.step(state, observation, epoch, batch, episode)
-
-                    observation = self._to_observation_tensors(observation)
-                    batch_observations += [observation.clone()]
-
-                    human_action = self._get_human_action()
-                    action = model.act(observation) if human_action is None else human_action
-                    batch_actions += [action]
-
-                    state, observation, reward, batch_done = environment.step(Action(action))
-                    batch_rewards += [reward]
-
-                    if batch_done or self._keyboard.is_pressed([pygame.K_b, pygame.K_e, pygame.K_s]):
-                        break
-
-                epoch_observations += [batch_observations]
-                epoch_actions += [batch_actions]
-                epoch_rewards += [batch_rewards]
-                epoch_weights += [self._compute_batch_weights(batch_observations, batch_actions, batch_rewards)]
-                if self._keyboard.is_pressed([pygame.K_e, pygame.K_s]):
+        rollouts = RolloutBuffer()
+        states = CheckpointWriter(self._out_path, hyper_params.states_keep_top)
+        with self._create_rollout_pool(hyper_params) as rollout_pool, states:
+            for epoch in range(hyper_params.epochs):
+                epoch_start = time.time()
+                reset_timers()
+                rollouts.clear()
+
+                if rollout_pool:
+                    with timer("keyboard"):
+                        self._keyboard.step()
+                    for rollout in rollout_pool.run(model.model):
+                        rollouts.start_batch()
+                        rollouts.extend(rollout.observations, rollout.actions, rollout.rewards)
+                else:
+                    environment = RlEnvironment(
+                        mode=hyper_params.environment_mode,
+                        total_resets=hyper_params.max_batches,
+                    )
+
+                    for batch in range(hyper_params.max_batches):
+                        rollouts.start_batch()
+                        state, observation = environment.reset()
+
+                        for episode in range(hyper_params.max_episodes):
+                            with timer("keyboard"):
+                                self._keyboard.step()
+                            with timer("display"):
+                                self._get_display().step(state, observation, epoch, batch, episode)
+
+                            with timer("tensors"):
+                                observation_tensors = to_observation_tensors(observation)
+
+                            human_action = self._get_human_action()
+                            with timer("act"):
+                                action = model.act(observation_tensors) if human_action is None else human_action
+
+                            state, observation, reward, batch_done = environment.step(Action(action))
+                            rollouts.append(observation_tensors, action, reward)
+
+                            if batch_done or self._keyboard.is_pressed([pygame.K_b, pygame.K_e, pygame.K_s]):
+                                break
+
+                        if self._keyboard.is_pressed([pygame.K_e, pygame.K_s]):
+                            break
+
+                with timer("weights"):
+                    for batch in rollouts.get_batches():
+                        rollouts.weights[batch] = self._compute_batch_weights(
+                            rollouts,
+                            batch,
+                            hyper_params.reward_to_go_discount,
+                        )
+                epoch_reward = float(np.mean(rollouts.get_batch_rewards()))
+                with timer("backprop"):
+                    epoch_loss = model.backprop(rollouts)
+                with timer("act"):  # Builds the acting model for the next epoch
+                    epoch_divergence = model.get_inference_divergence(ObservationTensors(
+                        *(tensor[:_DIVERGENCE_OBSERVATIONS] for tensor in rollouts.observations)
+                    ))
+                epoch_took = time.time() - epoch_start
+                epoch_phases = get_timers()
+
+                improvements += 1 if (epoch_reward > hyper_params_metrics.max_reward) else 0
+                epoch_metrics = Metrics()
+                epoch_metrics.update(epoch_reward, epoch_loss, improvements, epoch_took, epoch_phases)
+                hyper_params_metrics.update(epoch_reward, epoch_loss, improvements, epoch_took, epoch_phases)
+                hyper_param_list_metrics.update(epoch_reward, epoch_loss, improvements, epoch_took, epoch_phases)
+
+                print(" | ".join((
+                    f"{get_timestamp()}",
+                    f"epoch {epoch :4}",
+                    f"imp {epoch_metrics.improvements :3.0f} -> {hyper_params_metrics.improvements:3.0f} -> {hyper_param_list_metrics.improvements:3.0f}",
+                    f"reward {epoch_metrics.max_reward :5.0f} -> {hyper_params_metrics.max_reward:5.0f} -> {hyper_param_list_metrics.max_reward:5.0f}",
+                    f"loss {epoch_metrics.max_loss :5.0f} -> {hyper_params_metrics.max_loss:5.0f} -> {hyper_param_list_metrics.max_loss:5.0f}",
+                    f"took {epoch_metrics.took:5.1f}s -> {hyper_params_metrics.took:5.1f}s -> {hyper_param_list_metrics.took:5.1f}s",
+                    f"phases {epoch_metrics.to_phases_label()}",
+                    *([f"kl {epoch_divergence:.1e}"] if hyper_params.inference != Inference.EAGER else []),
+                    *([self._to_cache_label(rollout_pool)] if rollout_pool and hyper_params.observation_cache else []),
+                )))
+                if not hyper_params.dry_run and epoch_reward >= hyper_params.epoch_state_reward_threshold:
+                    filename = f"state_epoch{epoch}_reward{epoch_reward:.0f}.pth"
+                    states.save(filename, model.model, epoch_reward)
+                if self._keyboard.is_pressed([pygame.K_s]):
                     break
-
-            epoch_reward = float(np.mean([sum(batch) for batch in epoch_rewards]))
-            epoch_loss = model.backprop(
-                [el for batch in epoch_observations for el in batch],
-                [el for batch in epoch_actions for el in batch],
-                [el for batch in epoch_weights for el in batch],
-            )
-            epoch_took = time.time() - epoch_start
-
-            improvements += 1 if (epoch_reward > hyper_params_metrics.max_reward) else 0
-            epoch_metrics = Metrics()
-            epoch_metrics.update(epoch_reward, epoch_loss, improvements, epoch_took)
-            hyper_params_metrics.update(epoch_reward, epoch_loss, improvements, epoch_took)
-            hyper_param_list_metrics.update(epoch_reward, epoch_loss, improvements, epoch_took)
-
-            print(" | ".join((
-                f"{get_timestamp()}",
-                f"epoch {epoch :4}",
-                f"imp {epoch_metrics.improvements :3.0f} -> {hyper_params_metrics.improvements:3.0f} -> {hyper_param_list_metrics.improvements:3.0f}",
-                f"reward {epoch_metrics.max_reward :5.0f} -> {hyper_params_metrics.max_reward:5.0f} -> {hyper_param_list_metrics.max_reward:5.0f}",
-                f"loss {epoch_metrics.max_loss :5.0f} -> {hyper_params_metrics.max_loss:5.0f} -> {hyper_param_list_metrics.max_loss:5.0f}",
-                f"took {epoch_metrics.took:5.1f}s -> {hyper_params_metrics.took:5.1f}s -> {hyper_param_list_metrics.took:5.1f}s",
-            )))
-            if not hyper_params.dry_run and epoch_reward >= hyper_params.epoch_state_reward_threshold:
-                filename = f"state_epoch{epoch}_reward{epoch_reward:.0f}.pth"
-                file_paths.append(save_state(self._out_path, filename, model.model))
-            if self._keyboard.is_pressed([pygame.K_s]):
-                break
-        return file_paths
+        return states.paths
 
     @staticmethod
-    def _compute_batch_weights(
-            observations: List[Tensor],
-            actions: List[int],
-            rewards: List[float],
-    ) -> List[float]:
-        assert len(observations) == len(actions) and len(actions) == len(rewards)
-
-        def get_penalty(observation_: Tensor, action_: int) -> Optional[float]:
-            if torch.equal(observation_, observations[-1]) and action_ == actions[-1]:
-                return -CAR_MAX_SPEED * 2
-            elif torch.equal(observation_, observations[-2]) and action_ == actions[-2]:
-                return -CAR_MAX_SPEED
-            else:
-                return None
-
-        weights = []
-        for index, (observation, action, reward) in enumerate(zip(observations, actions, rewards)):
-            penalty = get_penalty(observation, action)
-            if penalty is None:
-                weights.append(reward)
-            else:
-                weights.append(penalty)
-        return weights
+    def _to_cache_label(rollout_pool: RolloutPool) -> str:
+        lookups = rollout_pool.cache_hits + rollout_pool.cache_misses
+        return f"cache {rollout_pool.cache_hits / max(1, lookups):.0%} of {lookups}"
 
     @staticmethod
-    def _to_observation_tensors(observation: Observation) -> Tensor:
-        def surface_to_tensor(surface: Surface) -> Tensor:
-            flat = np.frombuffer(pygame.image.tostring(surface, "RGB"), dtype=np.uint8)
-            shape = (surface.get_height(), surface.get_width(), 3)
-            as_array = np.transpose(flat.reshape(shape), (2, 1, 0))  # (3, W, H)
-            return torch.from_numpy(as_array.copy())
-
-        visual = surface_to_tensor(observation.view)
-        visual_normalized = visual / 255.0
-        _, height, width = visual.shape
-
-        speed = torch.full((1, width, height), observation.car.speed)
-        speed_normalized = (speed - CAR_MIN_SPEED) / (CAR_MAX_SPEED - CAR_MIN_SPEED)
+    def _create_rollout_pool(hyper_params: HyperParams) -> ContextManager[Optional[RolloutPool]]:
+        if not hyper_params.rollout_workers:
+            return contextlib.nullcontext()
+        return RolloutPool(
+            workers=hyper_params.rollout_workers,
+            model_params=hyper_params.model,
+            environment_mode=hyper_params.environment_mode,
+            total_resets=hyper_params.max_batches,
+            max_episodes=hyper_params.max_episodes,
+            inference=hyper_params.inference,
+            compile_model=hyper_params.compile_model,
+            observation_cache=hyper_params.observation_cache,
+        )
 
-        turn = torch.full((1, width, height), observation.car.turn)
-        turn_normalized = (turn - CAR_MIN_TURN) / (CAR_MAX_TURN - CAR_MIN_TURN)
+    @staticmethod
+    def _compute_batch_weights(
+            rollouts: RolloutBuffer,
+            batch: slice,
+            reward_to_go_discount: Optional[float] = None,
+    ) -> Tensor:
+        # Steps repeating the last (or second to last) observation and action are penalized, others get their reward
+        rewards = rollouts.rewards[batch].numpy()
+        if reward_to_go_discount is not None:
+            rewards = discounted_reverse_cumsum(rewards, reward_to_go_discount)
+        weights = torch.as_tensor(rewards, dtype=torch.float32)
+
+        for offset, penalty in ((-2, -CAR_MAX_SPEED), (-1, -CAR_MAX_SPEED * 2)):
+            if batch.stop - batch.start < -offset:
+                continue
+            reference = batch.stop + offset
+            candidates = batch.start + torch.nonzero(
+                (rollouts.fingerprints[batch] == rollouts.fingerprints[reference])
+                & (rollouts.actions[batch] == rollouts.actions[reference])
+            ).flatten()
+            repeated = candidates[  # Fingerprints may collide, compare the candidates exactly
+                (rollouts.pixels[candidates] == rollouts.pixels[reference]).flatten(1).all(dim=1)
+                & (rollouts.scalars[candidates] == rollouts.scalars[reference]).flatten(1).all(dim=1)
+            ]
+            weights[repeated - batch.start] = penalty
+        return weights
 
-        result = torch.cat([visual_normalized, speed_normalized, turn_normalized], dim=0)
-        return result
+    def _get_display(self) -> Display:
+        if self._display is None:
+            self._display = Display(self._keyboard)
+        return self._display
 
     def _get_human_action(self) -> Optional[int]:
         result: Optional[Action] = None
@@ -264,3 +389,17 @@ class Trainer:
         elif self._keyboard.is_pressed([pygame.K_n]):
             result = Action.NONE
         return result.value if result else None
+
+
+def _init_hyper_params_process(threads: int):
+    os.environ["SDL_VIDEODRIVER"] = "dummy"  # Runs are headless, only the parent process may own the window
+    pygame.init()
+    torch.set_num_threads(threads)
+
+
+def _run_hyper_params_process(out_path: str, index: int, total: int, hyper_params: HyperParams) -> _HyperParamsRun:
+    # Metrics across the list are only known to the parent, a run only aggregates over itself.
+    # Output is prefixed, as concurrent runs share the parent's stdout, but logged without it
+    with prefix_stdout(f"run {index}/{total} | "):
+        trainer = Trainer(path=out_path, out_path=out_path)
+        return trainer._run_hyper_params_logged(index, total, hyper_params, Metrics())
@@ -7,7 +7,9 @@ from rl.apps.car.common.constants import OBSERVATION_INPUT_SIDE
 from rl.apps.car.environment.car import Action
 from rl.apps.car.environment.rl import RlEnvironmentMode
 from rl.apps.car.helpers.trainer import HyperParams, Trainer
-from rl.apps.car.model.model import SelfDrivingCarModelParams
+from rl.apps.car.model.inference import Inference
+from rl.apps.car.model.model import SelfDrivingCarModelParams, ScalarInputs, get_vision_input_channels, \
+    get_decision_input_scalars
 
 
 def run_training_plan():
@@ -25,18 +27,23 @@ def run_training_plan():
             max_episodes=max_episodes,
             environment_mode=environment_mode,
             model=SelfDrivingCarModelParams(
-                vision_dimensions=vision_dimensions,
+                vision_dimensions=[get_vision_input_channels(scalar_inputs), *vision_hiddens],
                 vision_dropout=vision_dropout,
                 decision_dimensions=[
-                    visual_activation_flat(vision_dimensions),
+                    visual_activation_flat([get_vision_input_channels(scalar_inputs), *vision_hiddens])
+                    + get_decision_input_scalars(scalar_inputs),
                     *decision_hiddens,
                     len(Action),
                 ],
                 decision_residual=decision_residual,
                 decision_dropout=decision_dropout,
+                scalar_inputs=scalar_inputs,
                 # state_path="../../../../resources/rl/apps/car/out/2024-01-01T12-45-42/ret   167 | loss     4 | took  26.9m | lr 5e-05 | wd 0e+00 | e  500 | max_b  50 | max_ep 10000 | drpt 0.4 | rsdl     1 | vis_dim [5, 8, 10, 12, 16, 32] | dec_dim [2048, 1024, 512, 256, 128, 5] | 2024-01-01T16-48-55/state_epoch487_return167.pth",
             ),
-            epoch_state_return_threshold=100,
+            epoch_state_reward_threshold=100,
+            rollout_workers=int(os.environ.get("ROLLOUT_WORKERS", "0")),
+            inference=Inference[os.environ.get("INFERENCE", Inference.EAGER.name).upper()],
+            compile_model=os.environ.get("COMPILE_MODEL", "false").lower() == "true",
         )
         # Control
         for attempt in range(3)
@@ -76,11 +83,15 @@ def run_training_plan():
             # False,
             True,
         ]
-        for vision_dimensions in [
-            # [5, 8, 12, 16, 32, 64],
-            [5, 8, 10, 12, 16, 32], # default
-            # [5, 8, 10, 12, 16],
-            # [5, 8, 10, 16, 32],
+        for scalar_inputs in [
+            # ScalarInputs.PLANES,  # required by states saved before scalar inputs
+            ScalarInputs.DECISION,
+        ]
+        for vision_hiddens in [
+            # [8, 12, 16, 32, 64],
+            [8, 10, 12, 16, 32], # default
+            # [8, 10, 12, 16],
+            # [8, 10, 16, 32],
         ]  # each hidden reduces w and h by 2
         for decision_hiddens in [
             # [128],
@@ -91,10 +102,15 @@ def run_training_plan():
     ]
 
     trainer = Trainer(path="../../../../resources/rl/apps/car/out")
-    trainer.run_hyper_params_list(hyper_param_list)
+    trainer.run_hyper_params_list(
+        hyper_param_list,
+        concurrency=int(os.environ.get("SWEEP_CONCURRENCY", "1")),
+        threads_per_run=int(os.environ["SWEEP_THREADS"]) if "SWEEP_THREADS" in os.environ else None,
+    )
 
 
-os.environ["SDL_VIDEO_WINDOW_POS"] = "0,0"  # Open window in top left corner
-pygame.init()
-run_training_plan()
-pygame.quit()
+if __name__ == "__main__":  # Rollout workers are spawned and import this module
+    os.environ["SDL_VIDEO_WINDOW_POS"] = "0,0"  # Open window in top left corner
+    pygame.init()
+    run_training_plan()
+    pygame.quit()
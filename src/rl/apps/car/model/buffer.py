@@ -0,0 +1,108 @@
+from functools import cache
+from typing import List, Optional
+
+import torch
+import torch.nn.functional as functional
+from torch import Tensor
+
+from rl.apps.car.model.model import ObservationTensors
+
+_INITIAL_CAPACITY = 1024
+_FINGERPRINT_SEED = 11
+_FINGERPRINT_CHUNK = 256
+
+
+class RolloutBuffer:
+    # Contiguous per step tensors of an epoch, grown by doubling and reused after clear()
+    def __init__(self, capacity: int = _INITIAL_CAPACITY):
+        self.capacity = capacity
+        self.size = 0
+        self.batch_starts: List[int] = []
+
+        self.pixels: Optional[Tensor] = None  # Allocated on the first observation, when its shape is known
+        self.scalars: Optional[Tensor] = None
+        self.actions = torch.empty(capacity, dtype=torch.int64)
+        self.rewards = torch.empty(capacity, dtype=torch.float64)
+        self.weights = torch.empty(capacity, dtype=torch.float32)
+        self.fingerprints = torch.empty(capacity, dtype=torch.int64)  # Equal for equal observations
+
+    def __len__(self) -> int:
+        return self.size
+
+    @property
+    def observations(self) -> ObservationTensors:
+        return ObservationTensors(self.pixels[:self.size], self.scalars[:self.size])
+
+    def start_batch(self):
+        self.batch_starts.append(self.size)
+
+    def append(self, observation: ObservationTensors, action: int, reward: float):
+        self._reserve(observation, self.size + 1)
+        self.pixels[self.size] = observation.pixels
+        self.scalars[self.size] = observation.scalars
+        self.actions[self.size] = action
+        self.rewards[self.size] = reward
+        self.fingerprints[self.size] = get_fingerprints(ObservationTensors(
+            observation.pixels.unsqueeze(0),
+            observation.scalars.unsqueeze(0),
+        ))[0]
+        self.size += 1
+
+    def extend(self, observations: ObservationTensors, actions: List[int], rewards: List[float]):
+        end = self.size + len(actions)
+        self._reserve(ObservationTensors(observations.pixels[0], observations.scalars[0]), end)
+        self.pixels[self.size:end] = observations.pixels
+        self.scalars[self.size:end] = observations.scalars
+        self.actions[self.size:end] = torch.as_tensor(actions, dtype=torch.int64)
+        self.rewards[self.size:end] = torch.as_tensor(rewards, dtype=torch.float64)
+        self.fingerprints[self.size:end] = get_fingerprints(observations)
+        self.size = end
+
+    def get_batches(self) -> List[slice]:
+        ends = self.batch_starts[1:] + [self.size]
+        return [slice(start, end) for start, end in zip(self.batch_starts, ends)]
+
+    def get_batch_rewards(self) -> List[float]:
+        return [float(self.rewards[batch].sum()) for batch in self.get_batches()]
+
+    def clear(self):
+        self.size = 0
+        self.batch_starts.clear()
+
+    def _reserve(self, observation: ObservationTensors, size: int):
+        if self.pixels is None:
+            self.pixels = torch.empty((self.capacity, *observation.pixels.shape), dtype=observation.pixels.dtype)
+            self.scalars = torch.empty((self.capacity, *observation.scalars.shape), dtype=observation.scalars.dtype)
+        if size <= self.capacity:
+            return
+
+        capacity = self.capacity
+        while capacity < size:
+            capacity *= 2
+        for name in ("pixels", "scalars", "actions", "rewards", "weights", "fingerprints"):
+            previous = getattr(self, name)
+            value = torch.empty((capacity, *previous.shape[1:]), dtype=previous.dtype)
+            value[:self.size] = previous[:self.size]
+            setattr(self, name, value)
+        self.capacity = capacity
+
+
+def get_fingerprints(observations: ObservationTensors) -> Tensor:
+    # (N,), a random linear hash of the observation bytes, wrapping around on int64 overflow
+    result = []
+    for start in range(0, len(observations.scalars), _FINGERPRINT_CHUNK):
+        chunk = slice(start, start + _FINGERPRINT_CHUNK)
+        words = torch.cat([_to_words(tensor[chunk]) for tensor in observations], dim=1)
+        result.append((words * _get_fingerprint_coefficients(words.shape[1])).sum(dim=1))
+    return torch.cat(result)
+
+
+def _to_words(tensor: Tensor) -> Tensor:
+    as_bytes = tensor.reshape(len(tensor), -1).contiguous().view(torch.uint8)
+    return functional.pad(as_bytes, (0, -as_bytes.shape[1] % 8)).view(torch.int64)
+
+
+@cache
+def _get_fingerprint_coefficients(length: int) -> Tensor:
+    generator = torch.Generator().manual_seed(_FINGERPRINT_SEED)
+    return torch.randint(-2 ** 62, 2 ** 62, (length,), dtype=torch.int64, generator=generator) | 1
@@ -0,0 +1,81 @@
+import copy
+from enum import Enum
+
+import torch
+import torch.nn.functional as functional
+from torch import nn, Tensor
+from torch.ao.quantization import quantize_dynamic
+from torch.nn.utils.fusion import fuse_conv_bn_eval, fuse_linear_bn_eval
+
+from rl.apps.car.common.constants import OBSERVATION_OUTPUT_AREA
+from rl.apps.car.model.model import SelfDrivingCarModel, SelfDrivingCarModelParams, ObservationTensors, \
+    VISUAL_CHANNELS, SCALARS
+from rl.apps.car.utils.device import to_device
+
+_DIVERGENCE_CHUNK = 256
+QUANTIZED_DIVERGENCE_BOUND = 1e-4  # Mean KL divergence of QUANTIZED action distributions from EAGER ones
+
+
+class Inference(Enum):
+    EAGER = 1  # The training module itself, in eval mode
+    OPTIMIZED = 2  # Batch norms fused into the preceding layers, channels last, traced and frozen
+    # OPTIMIZED, with int8 weights and dynamically quantized activations for linear layers, on CPU.
+    # Acts within QUANTIZED_DIVERGENCE_BOUND of EAGER
+    QUANTIZED = 3
+
+
+class _ChannelsLast(nn.Module):
+    def forward(self, value: Tensor) -> Tensor:
+        return value.contiguous(memory_format=torch.channels_last)
+
+
+def optimize_for_inference(model: SelfDrivingCarModel, quantize: bool = False) -> torch.jit.ScriptModule:
+    # A frozen eval mode copy, so later training of the model does not affect it
+    result = copy.deepcopy(model).eval()
+    if quantize:
+        result = result.cpu()  # Quantized kernels are CPU only
+    for layer in result.vision.layers:
+        layer.convolution = fuse_conv_bn_eval(layer.convolution, layer.batch_norm)
+        layer.batch_norm = nn.Identity()
+        layer.optional_dropout = nn.Identity()
+    for layer in result.decision.layers:
+        layer.linear = fuse_linear_bn_eval(layer.linear, layer.batch_norm)
+        layer.batch_norm = nn.Identity()
+        layer.optional_dropout = nn.Identity()
+    if quantize:
+        result = quantize_dynamic(result, {nn.Linear}, dtype=torch.qint8)
+    result.vision.layers.insert(0, _ChannelsLast())
+    result = result.to(memory_format=torch.channels_last)
+
+    with torch.no_grad():
+        traced = torch.jit.trace(result, tuple(_get_example_observation()), check_trace=False)
+    return torch.jit.freeze(traced)
+
+
+def load_optimized_model(params: SelfDrivingCarModelParams, quantize: bool = False) -> torch.jit.ScriptModule:
+    # Weights from params.state_path
+    return optimize_for_inference(to_device(SelfDrivingCarModel(params)), quantize)
+
+
+def get_action_divergence(reference: nn.Module, candidate: nn.Module, observations: ObservationTensors) -> float:
+    # Mean KL divergence of the candidate action distributions from the reference ones, both modules in eval mode
+    result = 0.
+    with torch.inference_mode():
+        for start in range(0, len(observations.scalars), _DIVERGENCE_CHUNK):
+            chunk = ObservationTensors(*(tensor[start:start + _DIVERGENCE_CHUNK] for tensor in observations))
+            reference_log_probs = functional.log_softmax(reference(*chunk).float().cpu(), dim=-1)
+            candidate_log_probs = functional.log_softmax(candidate(*chunk).float().cpu(), dim=-1)
+            result += float(functional.kl_div(
+                candidate_log_probs,
+                reference_log_probs,
+                log_target=True,
+                reduction="sum",
+            ))
+    return result / len(observations.scalars)
+
+
+def _get_example_observation() -> ObservationTensors:
+    return ObservationTensors(
+        pixels=torch.zeros((1, VISUAL_CHANNELS, *OBSERVATION_OUTPUT_AREA), dtype=torch.uint8),
+        scalars=torch.zeros((1, SCALARS), dtype=torch.float32),
+    )
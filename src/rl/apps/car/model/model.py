@@ -1,12 +1,42 @@
 from dataclasses import dataclass
-from typing import Sequence, Optional, Dict
+from enum import Enum
+from typing import Sequence, Optional, Dict, NamedTuple
 
 import torch
 import torch.nn as nn
 from torch import Tensor
 
+from rl.apps.car.common.constants import CAR_MIN_SPEED, CAR_MAX_SPEED, CAR_MIN_TURN, CAR_MAX_TURN
 from rl.apps.car.utils.device import get_module_device
 
+VISUAL_CHANNELS = 3
+SCALARS = 2  # Speed, turn
+
+
+class ScalarInputs(Enum):
+    PLANES = 1  # Constant image planes appended to the visual channels
+    DECISION = 2  # Appended to the flat vision output
+
+
+def get_vision_input_channels(scalar_inputs: ScalarInputs) -> int:
+    return VISUAL_CHANNELS + SCALARS if scalar_inputs == ScalarInputs.PLANES else VISUAL_CHANNELS
+
+
+def get_decision_input_scalars(scalar_inputs: ScalarInputs) -> int:
+    return SCALARS if scalar_inputs == ScalarInputs.DECISION else 0
+
+
+class ObservationTensors(NamedTuple):
+    pixels: Tensor  # (..., 3, W, H), uint8
+    scalars: Tensor  # (..., 2), speed and turn
+
+
+def stack_observations(observations: Sequence[ObservationTensors]) -> ObservationTensors:
+    return ObservationTensors(
+        pixels=torch.stack([observation.pixels for observation in observations]),
+        scalars=torch.stack([observation.scalars for observation in observations]),
+    )
+
 
 class VisionConvolutionalLayer(nn.Module):
     def __init__(
@@ -123,20 +153,35 @@ class SelfDrivingCarModelParams:
     decision_residual: bool
     decision_dropout: float
     state_path: Optional[str] = None
+    scalar_inputs: ScalarInputs = ScalarInputs.PLANES
 
 
 class SelfDrivingCarModel(nn.Module):
     def __init__(self, params: SelfDrivingCarModelParams):
         super().__init__()
+        self.scalar_inputs = params.scalar_inputs
         self.vision = VisionModel(params.vision_dimensions, params.vision_dropout)
         self.decision = DecisionModel(params.decision_dimensions, params.decision_residual, params.decision_dropout)
         if params.state_path:
             self.load_state_dict(torch.load(params.state_path))
 
-    def forward(self, value: Tensor) -> Tensor:
-        value = value.to(get_module_device(self))
-
+    def forward(self, pixels: Tensor, scalars: Tensor) -> Tensor:
+        device = get_module_device(self)
+        visual = pixels.to(device) / 255.0
+        speed, turn = scalars.to(device, torch.float32).unbind(-1)
+        scalars = torch.stack([
+            (speed - CAR_MIN_SPEED) / (CAR_MAX_SPEED - CAR_MIN_SPEED),
+            (turn - CAR_MIN_TURN) / (CAR_MAX_TURN - CAR_MIN_TURN),
+        ], dim=-1)
+
+        if self.scalar_inputs == ScalarInputs.PLANES:
+            planes = scalars[..., None, None].expand(*scalars.shape, *visual.shape[-2:])
+            value = torch.cat([visual, planes], dim=-3)
+        else:
+            value = visual
         value = self.vision(value)
         value = torch.flatten(value, len(value.size()) - 3)
 
+        if self.scalar_inputs == ScalarInputs.DECISION:
+            value = torch.cat([value, scalars], dim=-1)
         return self.decision(value)
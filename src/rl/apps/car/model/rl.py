@@ -1,10 +1,14 @@
-from typing import List
+import math
+from typing import Tuple, Optional, Dict, List
 
 import torch
 from torch import nn, Tensor
 from torch.distributions import Categorical
 from torch.optim import Adam
 
+from rl.apps.car.model.buffer import RolloutBuffer
+from rl.apps.car.model.inference import Inference, optimize_for_inference, get_action_divergence
+from rl.apps.car.model.model import ObservationTensors
 from rl.apps.car.utils.device import to_device
 
 
@@ -15,37 +19,106 @@ class RlModel:
             dry_run: bool,
             learning_rate: float,
             weight_decay: float,
+            backprop_chunk_size: Optional[int] = None,
+            inference: Inference = Inference.EAGER,
+            compile_model: bool = False,
     ):
+        if backprop_chunk_size is not None and backprop_chunk_size < 3:
+            raise ValueError(
+                f"Backprop chunk size must be at least 3 (currently {backprop_chunk_size}), "
+                "so near equal chunks keep the 2 observations batch norms need in training mode"
+            )
         self.model = to_device(module)
         self.dry_run = dry_run
+        self.backprop_chunk_size = backprop_chunk_size  # Max observations per backprop chunk, None for all
         self.optimizer = Adam(
             self.model.parameters(),
             lr=learning_rate,
             weight_decay=weight_decay,
         )
+        self.inference = inference
+        self._inference_model: Optional[nn.Module] = None  # Built on demand, dropped when the weights change
 
-    def act(self, observations: Tensor) -> int:
-        result = self._get_policy(observations.unsqueeze(0), False).sample().item()
-        return result
+        # Compiled separately, so acting keeps static single observation shapes and backprop a dynamic batch size
+        # instead of recompiling for every epoch size
+        self._act_module = torch.compile(self.model, dynamic=False) if compile_model else self.model
+        self._backprop_module = torch.compile(self.model, dynamic=True) if compile_model else self.model
+
+    def act(self, observation: ObservationTensors) -> int:
+        # A batch of one as views, without copying
+        actions, _ = self.act_batch(ObservationTensors(
+            observation.pixels.unsqueeze(0),
+            observation.scalars.unsqueeze(0),
+        ))
+        return int(actions[0])
+
+    def act_batch(self, observations: ObservationTensors, with_log_probs: bool = False) -> Tuple[Tensor, Optional[Tensor]]:
+        with torch.inference_mode():
+            policy = self._get_inference_policy(observations)
+            actions = policy.sample()
+            log_probs = policy.log_prob(actions) if with_log_probs else None
+        return actions, log_probs
+
+    def backprop(self, rollouts: RolloutBuffer) -> float:
+        # Accumulates gradients over chunks, each weighted by its share of the mean loss over all observations
+        # Batch norms normalize each chunk by its own statistics, so chunked gradients are not those of a full backprop
+        observations = rollouts.observations
+        actions = rollouts.actions[:len(rollouts)]
+        weights = rollouts.weights[:len(rollouts)]
 
-    def backprop(self, observations: List[Tensor], actions: List[float], weights: List[float]) -> float:
-        loss = self._compute_loss(
-            observations=torch.stack(observations),
-            actions=torch.flatten(torch.as_tensor(actions, dtype=torch.int32)),
-            weights=torch.flatten(torch.as_tensor(weights, dtype=torch.float32))
-        )
         if not self.dry_run:
             self.optimizer.zero_grad()
-            loss.backward()
+        result = 0.
+        for chunk in self._get_backprop_chunks(len(rollouts)):
+            loss = self._compute_loss(
+                observations=ObservationTensors(observations.pixels[chunk], observations.scalars[chunk]),
+                actions=actions[chunk],
+                weights=weights[chunk],
+            ) * (len(actions[chunk]) / len(rollouts))
+            if not self.dry_run:
+                loss.backward()
+            result += float(loss.detach())
+        if not self.dry_run:
             self.optimizer.step()
-        return float(loss)
+            self._inference_model = None
+        return result
+
+    def load_state_dict(self, state_dict: Dict[str, Tensor]):
+        self.model.load_state_dict(state_dict)
+        self._inference_model = None
+
+    def _get_backprop_chunks(self, size: int) -> List[slice]:
+        # Near equal, so of at least 2 observations for more than a backprop_chunk_size of them
+        if not size:
+            return []
+        chunks = math.ceil(size / self.backprop_chunk_size) if self.backprop_chunk_size else 1
+        return [slice(size * index // chunks, size * (index + 1) // chunks) for index in range(chunks)]
 
-    def _get_policy(self, observations: Tensor, training: bool) -> Categorical:
-        self.model.train(training)
-        logits = self.model(observations)
+    def _get_policy(self, observations: ObservationTensors, training: bool) -> Categorical:
+        if self.model.training != training:  # train() walks all submodules
+            self.model.train(training)
+        logits = (self._backprop_module if training else self._act_module)(*observations)
         return Categorical(logits=logits)
 
-    def _compute_loss(self, observations: Tensor, actions: Tensor, weights: Tensor) -> Tensor:
+    def get_inference_divergence(self, observations: ObservationTensors) -> float:
+        # Of the acting model from the model in eval mode, 0 when they are the same
+        if self.inference == Inference.EAGER:
+            return 0.
+        if self.model.training:
+            self.model.train(False)
+        return get_action_divergence(self.model, self._get_inference_model(), observations)
+
+    def _get_inference_policy(self, observations: ObservationTensors) -> Categorical:
+        if self.inference == Inference.EAGER:
+            return self._get_policy(observations, False)
+        return Categorical(logits=self._get_inference_model()(*observations))
+
+    def _get_inference_model(self) -> nn.Module:
+        if self._inference_model is None:
+            self._inference_model = optimize_for_inference(self.model, quantize=self.inference == Inference.QUANTIZED)
+        return self._inference_model
+
+    def _compute_loss(self, observations: ObservationTensors, actions: Tensor, weights: Tensor) -> Tensor:
         policy_output = self._get_policy(observations, True)
         log_p = policy_output.log_prob(to_device(actions))
         log_p_loss = -(log_p * to_device(weights)).mean()
@@ -1,6 +1,8 @@
-from typing import Iterable, TypeVar, Iterator
+from collections import OrderedDict
+from typing import Iterable, TypeVar, Iterator, Generic, List, Optional, Hashable
 
 T = TypeVar("T")
+K = TypeVar("K", bound=Hashable)
 
 
 def unique_iterator(iterable: Iterable[T]) -> Iterator[T]:
@@ -9,3 +11,67 @@ def unique_iterator(iterable: Iterable[T]) -> Iterator[T]:
         if element not in seen:
             seen.add(element)
             yield element
+
+
+class RingBuffer(Generic[T]):
+    def __init__(self, capacity: int):
+        if capacity <= 0:
+            raise ValueError(f"Capacity must be positive (currently {capacity})")
+        self.capacity = capacity
+        self._items: List[Optional[T]] = [None] * capacity
+        self._start = 0
+        self._length = 0
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __getitem__(self, index: int) -> T:
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError(index)
+        return self._items[(self._start + index) % self.capacity]
+
+    def __iter__(self) -> Iterator[T]:
+        for index in range(self._length):
+            yield self[index]
+
+    def __reversed__(self) -> Iterator[T]:
+        for index in reversed(range(self._length)):
+            yield self[index]
+
+    def append(self, item: T):
+        self._items[(self._start + self._length) % self.capacity] = item
+        if self._length < self.capacity:
+            self._length += 1
+        else:
+            self._start = (self._start + 1) % self.capacity
+
+    def clear(self):
+        self._items = [None] * self.capacity
+        self._start = 0
+        self._length = 0
+
+
+class LastDistinct(Generic[K, T]):
+    # Latest value of each of the last `capacity` distinct keys, ordered from the least to the most recently seen
+    def __init__(self, capacity: int):
+        if capacity <= 0:
+            raise ValueError(f"Capacity must be positive (currently {capacity})")
+        self.capacity = capacity
+        self._values: "OrderedDict[K, T]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def add(self, key: K, value: T):
+        self._values[key] = value
+        self._values.move_to_end(key)
+        if len(self._values) > self.capacity:
+            self._values.popitem(last=False)
+
+    def oldest(self) -> T:
+        return next(iter(self._values.values()))
+
+    def clear(self):
+        self._values.clear()
@@ -1,9 +1,10 @@
 import os
 import shutil
-from typing import Iterable
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Iterable, Dict, List, Optional, Tuple
 
 import torch
-from torch import nn
+from torch import nn, Tensor
 
 
 def move_files(filenames: Iterable[str], target_directory: str):
@@ -21,7 +22,64 @@ def save_file(path: str, filename: str, content: str) -> str:
 
 
 def save_state(path: str, filename: str, module: nn.Module) -> str:
+    return _save_state_dict(path, filename, module.state_dict())
+
+
+def _save_state_dict(path: str, filename: str, state_dict: Dict[str, Tensor]) -> str:
+    # Written aside and renamed, so a file with the final name is always complete
     os.makedirs(path, exist_ok=True)
     full_path = os.path.join(path, filename)
-    torch.save(module.state_dict(), full_path)
+    torch.save(state_dict, f"{full_path}.tmp")
+    os.replace(f"{full_path}.tmp", full_path)
     return full_path
+
+
+class CheckpointWriter:
+    # Saves module states on a background thread, keeping the keep_top best by reward plus the latest one
+    def __init__(self, path: str, keep_top: Optional[int] = None):
+        self._path = path
+        self._keep_top = keep_top
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="checkpoint-writer")
+        self._pending: List[Future] = []
+        self._checkpoints: List[Tuple[float, str]] = []  # (reward, full path), oldest first, owned by the writer
+
+    @property
+    def paths(self) -> List[str]:
+        self._wait()
+        return [full_path for _, full_path in self._checkpoints]
+
+    def save(self, filename: str, module: nn.Module, reward: float):
+        # Snapshot in CPU memory, the module keeps training while the file is written
+        state_dict = {key: value.detach().to("cpu", copy=True) for key, value in module.state_dict().items()}
+        for future in self._pending:
+            if future.done():
+                future.result()  # Raises write errors
+        self._pending = [future for future in self._pending if not future.done()]
+        self._pending.append(self._executor.submit(self._write, filename, state_dict, reward))
+
+    def close(self):
+        self._wait()
+        self._executor.shutdown()
+
+    def __enter__(self) -> "CheckpointWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _wait(self):
+        for future in self._pending:
+            future.result()  # Raises write errors
+        self._pending.clear()
+
+    def _write(self, filename: str, state_dict: Dict[str, Tensor], reward: float):
+        self._checkpoints.append((reward, _save_state_dict(self._path, filename, state_dict)))
+        if self._keep_top is None:
+            return
+
+        latest = self._checkpoints[-1]
+        top = sorted(self._checkpoints, key=lambda checkpoint: -checkpoint[0])[:self._keep_top]
+        kept = [checkpoint for checkpoint in self._checkpoints if checkpoint is latest or checkpoint in top]
+        for _, full_path in set(self._checkpoints) - set(kept):
+            os.remove(full_path)
+        self._checkpoints = kept
@@ -1,10 +1,18 @@
-from typing import List, Optional
+import math
+from functools import cache
+from typing import List, Optional, Tuple
 
-from rl.apps.car.common.constants import SIDE, MARGIN, PAD, HALF, ROAD_MAP
+import numpy as np
+
+from rl.apps.car.common.constants import SIDE, MARGIN, PAD, HALF, ROAD_MAP, CANVAS_AREA
 from rl.apps.car.common.types import Vector, Shape
 from rl.apps.car.utils.math_util import distance
 from rl.apps.car.utils.shapes import rotate, rectangle_contains
 
+# Next tile directions as stored in the next tile grids, 0 is no next tile
+_NEXT_TILE_DIRECTIONS = np.array([(0, 0), (-1, 0), (1, 0), (0, -1), (0, 1)], dtype=np.int64)
+_LEFT, _RIGHT, _UP, _DOWN = 1, 2, 3, 4
+
 
 def is_unit_vector(vector: Vector) -> bool:
     x, y = vector
@@ -33,6 +41,11 @@ def get_tile(position: Vector) -> Vector:
     return tile_col, tile_row
 
 
+def get_tiles(positions: np.ndarray) -> np.ndarray:
+    # Same as get_tile() for (N, 2) positions
+    return ((positions - MARGIN) / SIDE).astype(np.int64)
+
+
 def get_tile_position(tile: Vector) -> Vector:
     tile_col, tile_row = tile
     return MARGIN + tile_col * SIDE, MARGIN + tile_row * SIDE
@@ -191,3 +204,68 @@ def road_next_tile(position: Vector, shape: Shape) -> Optional[Vector]:
         return next_for_L_curved(projected, (tile_col, tile_row + 1), (tile_col + 1, tile_row))
     else:
         return None
+
+
+def road_next_tiles(positions: np.ndarray, shape: Shape) -> Tuple[np.ndarray, np.ndarray]:
+    # Same as road_next_tile() for (N, 2) canvas pixels, as (N, 2) next tiles and (N,) whether there is one
+    directions = get_next_tile_grid(shape)[positions[:, 0], positions[:, 1]]
+    return get_tiles(positions) + _NEXT_TILE_DIRECTIONS[directions], directions != 0
+
+
+@cache
+def get_next_tile_grid(shape: Shape) -> np.ndarray:
+    # (W, H), road_next_tile() of every canvas pixel as an index into _NEXT_TILE_DIRECTIONS
+    x, y = np.meshgrid(np.arange(CANVAS_AREA[0]), np.arange(CANVAS_AREA[1]), indexing="ij")
+    x, y = x.astype(np.float64), y.astype(np.float64)
+    tile_col, tile_row = ((x - MARGIN) / SIDE).astype(np.int64), ((y - MARGIN) / SIDE).astype(np.int64)
+    tile_x, tile_y = MARGIN + tile_col * SIDE, MARGIN + tile_row * SIDE
+
+    def contains(rectangle_x, rectangle_y, width, height, x_, y_) -> np.ndarray:
+        return (rectangle_x <= x_) & (x_ <= rectangle_x + width) & (rectangle_y <= y_) & (y_ <= rectangle_y + height)
+
+    def rotate_(angle_degrees: int) -> Tuple[np.ndarray, np.ndarray]:
+        # Same operations as rotate() around the tile center
+        center_x, center_y = tile_x + SIDE / 2, tile_y + SIDE / 2
+        dx, dy = x - center_x, -(y - center_y)
+        sin, cos = math.sin(math.radians(angle_degrees)), math.cos(math.radians(angle_degrees))
+        return center_x + (dx * cos - dy * sin), center_y - (dx * sin + dy * cos)
+
+    def next_for_l_curved(x_, y_, left_turn_result: int, right_turn_result: int) -> np.ndarray:
+        curvature_radius = np.sqrt((x_ - (tile_x + SIDE - PAD)) ** 2 + (y_ - (tile_y + PAD)) ** 2)
+        out_top = contains(tile_x + PAD, tile_y, SIDE - PAD * 2, PAD, x_, y_)
+        out_right = contains(tile_x + SIDE - PAD, tile_y + PAD, PAD, SIDE - PAD * 2, x_, y_)
+        inside = (0 <= curvature_radius) & (curvature_radius <= (HALF - PAD) * 2)
+        turning_left = np.where(
+            out_top,
+            x_ < (tile_x + SIDE / 2),
+            np.where(out_right, y_ >= (tile_y + SIDE / 2), curvature_radius > (HALF - PAD)),
+        )
+        return np.where(
+            out_top | out_right | inside,
+            np.where(turning_left, left_turn_result, right_turn_result),
+            0,
+        )
+
+    if shape == "─":
+        result = np.where(
+            contains(tile_x, tile_y + PAD, SIDE, SIDE - PAD * 2, x, y),
+            np.where(y < (tile_y + SIDE / 2), _LEFT, _RIGHT),
+            0,
+        )
+    elif shape == "│":
+        result = np.where(
+            contains(tile_x + PAD, tile_y, SIDE - PAD * 2, SIDE, x, y),
+            np.where(x < (tile_x + SIDE / 2), _DOWN, _UP),
+            0,
+        )
+    elif shape == "└":
+        result = next_for_l_curved(x, y, _RIGHT, _UP)
+    elif shape == "┘":
+        result = next_for_l_curved(*rotate_(-90), _UP, _LEFT)
+    elif shape == "┐":
+        result = next_for_l_curved(*rotate_(-180), _LEFT, _DOWN)
+    elif shape == "┌":
+        result = next_for_l_curved(*rotate_(-270), _DOWN, _RIGHT)
+    else:
+        result = np.zeros(x.shape)
+    return result.astype(np.int8)
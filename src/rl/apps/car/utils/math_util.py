@@ -23,3 +23,21 @@ def normalize_min_max(values: Iterable[float]) -> List[float]:
         return [0.5 for _ in values]
     else:
         return [(value - min_) / (max_ - min_) for value in values]
+
+
+def discounted_reverse_cumsum(values: np.ndarray, discount: float) -> np.ndarray:
+    # result[t] = sum(discount ** (k - t) * values[k] for k >= t), in blocks so discount powers stay representable
+    values = np.asarray(values, dtype=np.float64)
+    if discount == 0:
+        return values.copy()
+    block = 1024 if discount >= 1 else max(1, min(1024, int(math.log(1e-150) / math.log(discount))))
+
+    result = np.empty_like(values)
+    carry = 0.
+    for end in range(len(values), 0, -block):
+        start = max(0, end - block)
+        powers = discount ** np.arange(end - start, dtype=np.float64)
+        local = np.cumsum((values[start:end] * powers)[::-1])[::-1] / powers
+        result[start:end] = local + carry * discount * powers[::-1]
+        carry = result[start]
+    return result
@@ -1,6 +1,8 @@
 import math
 from typing import Sequence, Optional, Iterator
 
+import numpy as np
+
 from rl.apps.car.common.types import AngleDegrees, Vector, Rectangle
 
 
@@ -135,3 +137,37 @@ def iterate_polygon_area(corners: Sequence[Vector]) -> Iterator[Vector]:
         for y in range(math.floor(min_y), math.ceil(max_y + 1)):
             if polygon_contains(corners, (x, y)):
                 yield x, y
+
+
+def polygon_perimeter(corners: Sequence[Vector]) -> np.ndarray:
+    # Same points as iterate_polygon_perimeter(), as (N, 2) ints
+    lines = []
+    for i in range(len(corners)):
+        start_x, start_y = corners[i]
+        end_x, end_y = corners[(i + 1) % len(corners)]
+        steps = int(max(abs(end_x - start_x), abs(end_y - start_y)))
+        t = np.arange(steps + 1) / steps
+        lines.append(np.stack([start_x + t * (end_x - start_x), start_y + t * (end_y - start_y)], axis=1))
+    points = np.round(np.concatenate(lines)).astype(np.int64)
+    return points[~polygon_contains_points(corners, points)]
+
+
+def polygon_contains_points(corners: Sequence[Vector], points: np.ndarray) -> np.ndarray:
+    # Same as polygon_contains() for (N, 2) points
+    result = np.zeros(len(points), dtype=bool)
+    x, y = points[:, 0], points[:, 1]
+
+    for i in range(len(corners)):
+        this_corner_x, this_corner_y = corners[i]
+        that_corner_x, that_corner_y = corners[(i + 1) % len(corners)]
+
+        crossing = (min(this_corner_y, that_corner_y) < y) & (y <= max(this_corner_y, that_corner_y))
+        crossing &= x <= max(this_corner_x, that_corner_x)
+        if that_corner_y != this_corner_y:
+            x_cross = (y - that_corner_y) * (this_corner_x - that_corner_x) / (
+                    this_corner_y - that_corner_y) + that_corner_x
+        else:
+            x_cross = that_corner_x
+        result ^= crossing & (x <= x_cross)
+
+    return result
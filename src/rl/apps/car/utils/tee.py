@@ -27,6 +27,37 @@ class _StdoutCapture:
         sys.stdout = self.stdout
 
 
+class _StdoutPrefix:
+    def __init__(self, prefix: str):
+        self.stdout = sys.stdout
+        self.prefix = prefix
+        self._line_start = True
+
+    def write(self, message: str):
+        for line in message.splitlines(keepends=True):
+            if self._line_start:
+                self.stdout.write(self.prefix)
+            self.stdout.write(line)
+            self._line_start = line.endswith("\n")
+
+    def flush(self):
+        self.stdout.flush()
+
+    def __enter__(self) -> "_StdoutPrefix":
+        sys.stdout = self
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        sys.stdout = self.stdout
+
+
+@contextlib.contextmanager
+def prefix_stdout(prefix: str):
+    # Prefixes every line written to stdout
+    with _StdoutPrefix(prefix) as output:
+        yield output
+
+
 @contextlib.contextmanager
 def capture_stdout():
     with _StdoutCapture() as output:
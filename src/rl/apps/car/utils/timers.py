@@ -0,0 +1,28 @@
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, Iterator
+
+_timers: Dict[str, float] = defaultdict(float)  # Seconds per phase, since the last reset
+
+
+@contextmanager
+def timer(name: str) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _timers[name] += time.perf_counter() - start
+
+
+def get_timers() -> Dict[str, float]:
+    return dict(_timers)
+
+
+def add_timers(timers: Dict[str, float]):
+    for name, seconds in timers.items():
+        _timers[name] += seconds
+
+
+def reset_timers():
+    _timers.clear()
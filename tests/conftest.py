@@ -0,0 +1,36 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")  # Headless
+
+
+@pytest.fixture(scope="session", autouse=True)
+def pygame_session():
+    import pygame
+    pygame.init()
+    yield
+    pygame.quit()
+
+
+@pytest.fixture(scope="session")
+def observations():
+    # 64 stacked observations of an environment driven at random, with resets
+    from random import Random
+    from rl.apps.car.environment.car import Action
+    from rl.apps.car.environment.rl import RlEnvironment, RlEnvironmentMode
+    from rl.apps.car.helpers.rollout import to_observation_tensors
+    from rl.apps.car.model.model import stack_observations
+
+    environment = RlEnvironment(RlEnvironmentMode.ORDERED_WITH_CRASH_REPLAY, 4)
+    random = Random(0)
+    result = [to_observation_tensors(environment.reset()[1])]
+    while len(result) < 64:
+        _, observation, _, done = environment.step(random.choice(list(Action)))
+        result.append(to_observation_tensors(observation))
+        if done:
+            environment.reset_index = 0
+            result.append(to_observation_tensors(environment.reset()[1]))
+    return stack_observations(result[:64])
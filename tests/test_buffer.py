@@ -0,0 +1,49 @@
+import torch
+
+from rl.apps.car.model.buffer import RolloutBuffer, get_fingerprints
+from rl.apps.car.model.model import ObservationTensors
+
+_OBSERVATIONS = 600  # Over several fingerprint chunks
+
+
+def _get_observations() -> ObservationTensors:
+    generator = torch.Generator().manual_seed(0)
+    return ObservationTensors(
+        pixels=torch.randint(0, 256, (_OBSERVATIONS, 3, 16, 16), dtype=torch.uint8, generator=generator),
+        scalars=torch.rand((_OBSERVATIONS, 2), generator=generator),
+    )
+
+
+def test_fingerprints_equal_for_identical_observations():
+    observations = _get_observations()
+    duplicates = ObservationTensors(observations.pixels.clone(), observations.scalars.clone())
+    assert torch.equal(get_fingerprints(observations), get_fingerprints(duplicates))
+
+    reordered = torch.randperm(_OBSERVATIONS)
+    assert torch.equal(
+        get_fingerprints(ObservationTensors(observations.pixels[reordered], observations.scalars[reordered])),
+        get_fingerprints(observations)[reordered],
+    )
+
+
+def test_fingerprints_differ_for_different_observations():
+    observations = _get_observations()
+    fingerprints = get_fingerprints(observations)
+    assert len(set(fingerprints.tolist())) == _OBSERVATIONS
+
+    pixels = observations.pixels.clone()
+    pixels[:, 1, 5, 7] ^= 1
+    assert not torch.any(get_fingerprints(ObservationTensors(pixels, observations.scalars)) == fingerprints)
+
+    scalars = observations.scalars.clone()
+    scalars[:, 0] += 1e-3
+    assert not torch.any(get_fingerprints(ObservationTensors(observations.pixels, scalars)) == fingerprints)
+
+
+def test_append_and_extend_fingerprints_match():
+    observations = _get_observations()
+    appended, extended = RolloutBuffer(), RolloutBuffer()
+    for pixels, scalars in zip(observations.pixels, observations.scalars):
+        appended.append(ObservationTensors(pixels, scalars), 0, 0.)
+    extended.extend(observations, [0] * _OBSERVATIONS, [0.] * _OBSERVATIONS)
+    assert torch.equal(appended.fingerprints[:_OBSERVATIONS], extended.fingerprints[:_OBSERVATIONS])
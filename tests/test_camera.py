@@ -0,0 +1,32 @@
+import numpy as np
+import pygame
+import pytest
+
+from rl.apps.car.common.constants import MARGIN, SIDE
+from rl.apps.car.environment.car import CarState, CarObservation
+from rl.apps.car.environment.environment import ObservationRenderer, render_environment
+
+# Reset poses, then subpixel positions at angles in steps of the turn rate and off them
+_POSES = [
+    ((MARGIN + 8.5 * SIDE, MARGIN + 1.5 * SIDE), 135., False),
+    ((MARGIN + 8.2 * SIDE, MARGIN + 1.8 * SIDE), 315., True),
+    ((MARGIN + 4 * SIDE, MARGIN + 3.7 * SIDE), 0., False),
+    ((MARGIN + 4 * SIDE, MARGIN + 3.3 * SIDE), 180., True),
+    ((MARGIN + 2.7 * SIDE, MARGIN + 2 * SIDE), 90., False),
+    ((MARGIN + 2.3 * SIDE, MARGIN + 2 * SIDE), 270., False),
+    ((MARGIN + 5.5 * SIDE + .25, MARGIN + 1.7 * SIDE + .75), 3., False),
+    ((MARGIN + 5.5 * SIDE + .4, MARGIN + 1.3 * SIDE + .1), 177., True),
+    ((MARGIN + 7 * SIDE + .6, MARGIN + 0.7 * SIDE + .3), 42., False),
+    ((MARGIN + 7.8 * SIDE + .9, MARGIN + 1.2 * SIDE + .45), 228., True),
+    ((MARGIN + 3.1 * SIDE + .33, MARGIN + 3.4 * SIDE + .66), 351., False),
+    ((MARGIN + 6.2 * SIDE + .5, MARGIN + 2.6 * SIDE + .5), 97.5, False),
+    ((MARGIN + 1.4 * SIDE + .12, MARGIN + 4.4 * SIDE + .87), 301.25, True),
+]
+
+
+@pytest.mark.parametrize("position, angle, decelerating", _POSES)
+def test_numpy_observation_matches_pygame(position, angle, decelerating):
+    car = CarState(position=position, angle=angle, turn=0, speed=1, decelerating=decelerating)
+    _, expected = render_environment(car, CarObservation(car.turn, car.speed), ObservationRenderer.PYGAME)
+    _, actual = render_environment(car, CarObservation(car.turn, car.speed), ObservationRenderer.NUMPY, view=False)
+    assert np.array_equal(actual.view, pygame.surfarray.array3d(expected.view))
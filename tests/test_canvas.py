@@ -0,0 +1,45 @@
+from random import Random
+
+import pygame
+import pytest
+
+from rl.apps.car.common.constants import CANVAS_AREA, WHITE, LIGHT_BLACK, MARGIN, ACTION_AREA
+from rl.apps.car.environment.car import CarState, CrossroadEvent, Events, Blink
+from rl.apps.car.helpers.canvas import draw_car, get_car_shapes
+
+_POSES = 250
+
+
+def _draw_car_directly(surface: pygame.Surface, car: CarState) -> pygame.Surface:
+    # As draw_car() did before sprites
+    body_corners, window_corners, lights = get_car_shapes(car)
+    pygame.draw.polygon(surface, WHITE, body_corners)
+    pygame.draw.polygon(surface, LIGHT_BLACK, window_corners)
+    for color, light in lights:
+        pygame.draw.circle(surface, color, light, 2)
+    return surface
+
+
+def _get_car(random: Random) -> CarState:
+    crossroad = None
+    if random.random() < .5:
+        crossroad = CrossroadEvent(random.choice(list(Blink)), (0, 0, 0, 0), (0, 0), (0, 0), "+", (0, 0), (0, 0))
+    return CarState(
+        # Where cars are kept, so shapes stay at positive coordinates pygame floors
+        position=(random.uniform(MARGIN, MARGIN + ACTION_AREA[0]), random.uniform(MARGIN, MARGIN + ACTION_AREA[1])),
+        angle=random.choice([random.uniform(0, 360), random.randrange(120) * 3.]),
+        turn=0,
+        speed=1,
+        decelerating=random.random() < .5,
+        events=Events(crossroad),
+    )
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_draw_car_matches_drawing_at_exact_position(seed):
+    random = Random(seed)
+    for _ in range(_POSES):
+        car = _get_car(random)
+        actual = draw_car(pygame.Surface(CANVAS_AREA), car)
+        expected = _draw_car_directly(pygame.Surface(CANVAS_AREA), car)
+        assert pygame.image.tostring(actual, "RGB") == pygame.image.tostring(expected, "RGB"), car
@@ -0,0 +1,80 @@
+from random import Random
+from typing import List
+
+import pytest
+
+from rl.apps.car.environment.car import Action, CarState
+from rl.apps.car.environment.rl import RlEnvironment, RlEnvironmentMode, _CRASH_REPLAY_STEPS_INTO_PAST
+from rl.apps.car.utils.collections import RingBuffer, LastDistinct
+
+
+def _get_car_before_crash(history: List[CarState], steps_into_past: int = _CRASH_REPLAY_STEPS_INTO_PAST) -> CarState:
+    # As RlEnvironment did on its full list history, before RingBuffer and LastDistinct
+    result = history[0]
+    skipped = set()
+    for car in reversed(history):
+        if car.position not in skipped:
+            result = car
+            if steps_into_past == 0:
+                break
+            else:
+                skipped.add(car.position)
+                steps_into_past -= 1
+    return result
+
+
+def test_ring_buffer_wraps_around():
+    buffer = RingBuffer(3)
+    for item in range(7):
+        buffer.append(item)
+        assert list(buffer) == list(range(max(0, item - 2), item + 1))
+    assert len(buffer) == 3
+    assert (buffer[0], buffer[-1]) == (4, 6)
+    assert list(reversed(buffer)) == [6, 5, 4]
+    with pytest.raises(IndexError):
+        _ = buffer[3]
+
+    buffer.clear()
+    assert list(buffer) == []
+    buffer.append(7)
+    assert list(buffer) == [7]
+
+
+def test_last_distinct_evicts_least_recently_seen():
+    last_distinct = LastDistinct(3)
+    for key, value in [("a", 1), ("b", 2), ("a", 3), ("c", 4)]:
+        last_distinct.add(key, value)
+    assert last_distinct.oldest() == 2  # "b", as "a" was seen again after it
+
+    last_distinct.add("d", 5)  # Evicts "b"
+    assert len(last_distinct) == 3
+    assert last_distinct.oldest() == 3  # Latest value of "a"
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_last_distinct_matches_list_history(seed):
+    random = Random(seed)
+    cars: List[CarState] = []
+    last_distinct = LastDistinct(_CRASH_REPLAY_STEPS_INTO_PAST + 1)
+    for step in range(300):
+        # Few positions, often repeated as by a stopped car
+        car = CarState(position=(random.randrange(15), 0), angle=step, turn=0, speed=0)
+        cars.append(car)
+        last_distinct.add(car.position, car)
+        assert last_distinct.oldest() == _get_car_before_crash(cars)
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_crash_replay_matches_list_history(seed):
+    environment = RlEnvironment(RlEnvironmentMode.ORDERED_WITH_CRASH_REPLAY, 400, render=False)
+    random = Random(seed)
+    actions = [Action.NONE, Action.ACCELERATION, Action.DECELERATION, Action.LEFT, Action.RIGHT]
+    for _ in range(40):
+        state, _ = environment.reset()
+        cars = [state.car]
+        for _ in range(random.randrange(1, 200)):  # Also past the history capacity
+            state, _, _, done = environment.step(random.choice(actions))
+            cars.append(state.car)
+            if done:
+                break
+        assert environment._get_car_before_crash() == _get_car_before_crash(cars)
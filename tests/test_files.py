@@ -0,0 +1,31 @@
+import os
+
+import pytest
+import torch
+from torch import nn
+
+from rl.apps.car.utils.files import CheckpointWriter
+
+_REWARDS = [3., 9., 1., 7., 7., 12., 2., 5., 8., 0.]
+
+
+@pytest.mark.parametrize("keep_top", [1, 3, None])
+def test_checkpoint_writer_keeps_top_and_latest(tmp_path, keep_top):
+    module = nn.Linear(4, 2)
+    weights = {}
+    with CheckpointWriter(str(tmp_path), keep_top) as writer:
+        for index, reward in enumerate(_REWARDS):
+            with torch.no_grad():
+                module.weight.fill_(index)  # Also changes the module while the previous write may be pending
+            writer.save(f"state {index}.pth", module, reward)
+            weights[f"state {index}.pth"] = index
+        paths = writer.paths
+
+    by_reward = sorted(range(len(_REWARDS)), key=lambda index: -_REWARDS[index])
+    kept = set(by_reward[:keep_top] if keep_top is not None else by_reward) | {len(_REWARDS) - 1}
+    expected = {f"state {index}.pth" for index in kept}
+    assert set(os.listdir(tmp_path)) == expected  # No .tmp files either
+    assert {os.path.basename(path) for path in paths} == expected
+    for filename in expected:
+        state_dict = torch.load(os.path.join(tmp_path, filename))
+        assert torch.all(state_dict["weight"] == weights[filename])
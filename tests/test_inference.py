@@ -0,0 +1,52 @@
+import pytest
+import torch
+
+from rl.apps.car.common.constants import OBSERVATION_INPUT_SIDE
+from rl.apps.car.environment.car import Action
+from rl.apps.car.model.inference import optimize_for_inference, get_action_divergence, QUANTIZED_DIVERGENCE_BOUND
+from rl.apps.car.model.model import SelfDrivingCarModel, SelfDrivingCarModelParams, ScalarInputs, \
+    get_vision_input_channels, get_decision_input_scalars
+
+_VISION_HIDDENS = [8, 10, 12, 16, 32]  # Same as main.run_training_plan() defaults
+_DECISION_HIDDENS = [1024, 512, 256, 128]
+
+
+def _create_model(scalar_inputs: ScalarInputs) -> SelfDrivingCarModel:
+    torch.manual_seed(0)
+    vision_dimensions = [get_vision_input_channels(scalar_inputs), *_VISION_HIDDENS]
+    side = OBSERVATION_INPUT_SIDE / (2 ** (len(vision_dimensions) - 2))
+    model = SelfDrivingCarModel(SelfDrivingCarModelParams(
+        vision_dimensions=vision_dimensions,
+        vision_dropout=0.3,
+        decision_dimensions=[
+            int(vision_dimensions[-1] * side * side) + get_decision_input_scalars(scalar_inputs),
+            *_DECISION_HIDDENS,
+            len(Action),
+        ],
+        decision_residual=True,
+        decision_dropout=0.3,
+        scalar_inputs=scalar_inputs,
+    ))
+
+    # Batch norm statistics away from their initial identity, so fusing them is checked
+    for module in model.modules():
+        if isinstance(module, (torch.nn.BatchNorm1d, torch.nn.BatchNorm2d)):
+            module.running_mean.uniform_(-1, 1)
+            module.running_var.uniform_(.5, 2)
+    return model.eval()
+
+
+@pytest.mark.parametrize("scalar_inputs", list(ScalarInputs), ids=lambda scalar_inputs: scalar_inputs.name)
+def test_optimized_logits_match_eager(observations, scalar_inputs):
+    model = _create_model(scalar_inputs)
+    optimized = optimize_for_inference(model)
+    with torch.inference_mode():
+        expected, actual = model(*observations), optimized(*observations)
+    assert torch.allclose(actual, expected, rtol=1e-5, atol=1e-5)
+
+
+@pytest.mark.parametrize("scalar_inputs", list(ScalarInputs), ids=lambda scalar_inputs: scalar_inputs.name)
+def test_quantized_divergence_is_bounded(observations, scalar_inputs):
+    model = _create_model(scalar_inputs)
+    quantized = optimize_for_inference(model, quantize=True)
+    assert get_action_divergence(model, quantized, observations) < QUANTIZED_DIVERGENCE_BOUND
@@ -0,0 +1,22 @@
+import numpy as np
+import pytest
+
+from rl.apps.car.utils.math_util import discounted_reverse_cumsum
+
+
+def _discounted_reverse_cumsum(values: np.ndarray, discount: float) -> np.ndarray:
+    # Plain reward to go loop
+    result = np.empty(len(values), dtype=np.float64)
+    running = 0.
+    for index in reversed(range(len(values))):
+        running = values[index] + discount * running
+        result[index] = running
+    return result
+
+
+@pytest.mark.parametrize("discount", [0., 0.5, 0.9, 0.99, 0.999, 1.])
+@pytest.mark.parametrize("size", [0, 1, 7, 1024, 5000])
+def test_discounted_reverse_cumsum_matches_loop(discount, size):
+    rewards = np.random.default_rng(size).normal(scale=10, size=size)
+    expected = _discounted_reverse_cumsum(rewards, discount)
+    np.testing.assert_allclose(discounted_reverse_cumsum(rewards, discount), expected, rtol=1e-9, atol=1e-9)
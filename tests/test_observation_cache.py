@@ -0,0 +1,54 @@
+from random import Random
+
+import pytest
+
+from rl.apps.car.environment.car import Action
+from rl.apps.car.environment.environment import ObservationRenderer
+from rl.apps.car.environment.rl import RlEnvironment, RlEnvironmentMode
+from rl.apps.car.helpers.observation_cache import ObservationCache, ObservationCacheParams
+from rl.apps.car.helpers.rollout import to_observation_tensors
+from rl.apps.car.helpers.trainer import HyperParams
+
+_STEPS = 100
+
+
+def _run(environment: RlEnvironment, cache: ObservationCache, actions):
+    # Same reset car every run, as each car is reset to once
+    environment.reset_index = 0
+    environment.reset()
+    for action in actions:
+        environment.step(action)
+        fresh = to_observation_tensors(environment.render())
+        if (cached := cache.get(environment.state.car)) is None:
+            cache.put(environment.state.car, fresh.pixels)
+        else:
+            assert cached.equal(fresh.pixels)
+
+
+@pytest.mark.parametrize("renderer", list(ObservationRenderer), ids=lambda renderer: renderer.name)
+def test_cache_hits_match_fresh_renders(renderer):
+    environment = RlEnvironment(RlEnvironmentMode.ORDERED_WITH_CRASH_REPLAY, 4, renderer, render=False)
+    cache = ObservationCache(ObservationCacheParams())
+    random = Random(0)
+    actions = [random.choice([Action.NONE, Action.ACCELERATION, Action.LEFT, Action.RIGHT]) for _ in range(_STEPS)]
+
+    _run(environment, cache, actions)
+    hits, misses = cache.hits, cache.misses
+    _run(environment, cache, actions)  # Same states again, all from the cache
+    assert (cache.hits, cache.misses) == (hits + _STEPS, misses)
+
+
+def test_cache_without_rollout_workers_is_rejected():
+    with pytest.raises(ValueError):
+        HyperParams(
+            dry_run=True,
+            epochs=1,
+            learning_rate=0.,
+            weight_decay=0.,
+            max_batches=4,
+            max_episodes=1,
+            environment_mode=RlEnvironmentMode.ORDERED_WITH_CRASH_REPLAY,
+            model=None,
+            epoch_state_reward_threshold=0,
+            observation_cache=ObservationCacheParams(),
+        )
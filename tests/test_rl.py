@@ -0,0 +1,103 @@
+from typing import Optional
+
+import pytest
+import torch
+from torch import nn
+
+from rl.apps.car.common.constants import OBSERVATION_INPUT_SIDE
+from rl.apps.car.environment.car import Action
+from rl.apps.car.model.buffer import RolloutBuffer
+from rl.apps.car.model.model import SelfDrivingCarModel, SelfDrivingCarModelParams, ScalarInputs, ObservationTensors, \
+    get_vision_input_channels, get_decision_input_scalars
+from rl.apps.car.model.rl import RlModel
+
+_VISION_HIDDENS = [8, 10, 12, 16, 32]  # Same as main.run_training_plan() defaults
+_DECISION_HIDDENS = [256, 128]
+
+
+@pytest.fixture
+def float64():
+    # Batch norm backward over a few near identical frames cancels out most of the gradient, amplifying float32
+    # rounding far beyond a useful tolerance
+    torch.set_default_dtype(torch.float64)
+    yield
+    torch.set_default_dtype(torch.float32)
+
+
+def _create_model(batch_norm: bool) -> SelfDrivingCarModel:
+    # Without dropout, so every backprop sees the same network
+    torch.manual_seed(0)
+    vision_dimensions = [get_vision_input_channels(ScalarInputs.PLANES), *_VISION_HIDDENS]
+    side = OBSERVATION_INPUT_SIDE / (2 ** (len(vision_dimensions) - 2))
+    model = SelfDrivingCarModel(SelfDrivingCarModelParams(
+        vision_dimensions=vision_dimensions,
+        vision_dropout=0.,
+        decision_dimensions=[
+            int(vision_dimensions[-1] * side * side) + get_decision_input_scalars(ScalarInputs.PLANES),
+            *_DECISION_HIDDENS,
+            len(Action),
+        ],
+        decision_residual=True,
+        decision_dropout=0.,
+    ))
+    if not batch_norm:
+        for module in model.modules():
+            if hasattr(module, "batch_norm"):
+                module.batch_norm = nn.Identity()
+    return model
+
+
+def _get_gradient(
+        observations: ObservationTensors,
+        batch_norm: bool,
+        backprop_chunk_size: Optional[int] = None,
+        batch: slice = slice(None),
+) -> torch.Tensor:
+    generator = torch.Generator().manual_seed(0)
+    size = len(observations.scalars)
+    actions = torch.randint(0, len(Action), (size,), generator=generator)[batch]
+    weights = (torch.rand(size, generator=generator) * 10)[batch]
+
+    rollouts = RolloutBuffer()
+    rollouts.extend(ObservationTensors(observations.pixels[batch], observations.scalars[batch]), actions.tolist(),
+                    [0.] * len(actions))
+    rollouts.weights[:len(actions)] = weights
+    model = RlModel(_create_model(batch_norm), False, 0., 0., backprop_chunk_size)
+    model.backprop(rollouts)
+    return torch.cat([parameter.grad.flatten().cpu() for parameter in model.model.parameters()])
+
+
+@pytest.mark.parametrize("backprop_chunk_size", [3, 4, 7, 10])
+def test_backprop_chunks_do_not_exceed_chunk_size(backprop_chunk_size):
+    model = RlModel(_create_model(True), True, 0., 0., backprop_chunk_size)
+    for size in range(100):
+        chunks = model._get_backprop_chunks(size)
+        assert [index for chunk in chunks for index in range(size)[chunk]] == list(range(size))
+        assert all(2 <= chunk.stop - chunk.start <= backprop_chunk_size for chunk in chunks if size > 1)
+
+
+@pytest.mark.parametrize("backprop_chunk_size", [0, 1, 2])
+def test_backprop_chunk_size_below_3_is_rejected(backprop_chunk_size):
+    with pytest.raises(ValueError):
+        RlModel(_create_model(True), True, 0., 0., backprop_chunk_size)
+
+
+@pytest.mark.parametrize("backprop_chunk_size", [3, 10, 32])
+def test_chunked_gradient_matches_full_backprop_without_batch_norm(observations, float64, backprop_chunk_size):
+    full = _get_gradient(observations, False)
+    chunked = _get_gradient(observations, False, backprop_chunk_size)
+    assert (chunked - full).norm() / full.norm() < 1e-9
+
+
+@pytest.mark.parametrize("backprop_chunk_size", [3, 10, 32])
+def test_chunked_gradient_is_weighted_mean_of_chunk_gradients(observations, float64, backprop_chunk_size):
+    # Batch norms normalize each chunk by its own statistics, so with them a chunked backprop equals separate
+    # backprops of the chunks rather than the full one
+    size = len(observations.scalars)
+    model = RlModel(_create_model(True), True, 0., 0., backprop_chunk_size)
+    expected = sum(
+        _get_gradient(observations, True, batch=chunk) * (chunk.stop - chunk.start) / size
+        for chunk in model._get_backprop_chunks(size)
+    )
+    chunked = _get_gradient(observations, True, backprop_chunk_size)
+    assert (chunked - expected).norm() / expected.norm() < 1e-9